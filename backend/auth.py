@@ -1,14 +1,24 @@
-import bcrypt
+import asyncio
 import jwt
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from types import SimpleNamespace
 import random
 
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 
-from db import SessionLocal
-from models import User
+import metrics
+from cache import TTLCache
+from db import get_db
+import versions
+from models import ResourceVersion, User
 
 
 SECRET_KEY = "super-secret-key"
@@ -17,6 +27,20 @@ ALGORITHM = "HS256"
 security = HTTPBearer()
 
 
+# token -> principal snapshot. Kept short-lived since every worker holds its
+# own copy and only sees invalidations for writes it served itself.
+principal_cache = TTLCache(
+    maxsize=int(os.getenv("PRINCIPAL_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("PRINCIPAL_CACHE_TTL", "60")),
+)
+
+_PRIVATE_USER_FIELDS = {"hashed_password", "verification_code"}
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE_DEPTH = int(os.getenv("PASSWORD_HASH_QUEUE_DEPTH", "32"))
+
+
 
 
 
@@ -36,19 +60,78 @@ def generate_verification_code_with_expiration() -> tuple:
 
 
 def hash_password(password: str) -> str:
+    import bcrypt
+
     return bcrypt.hashpw(
         password.encode(),
-        bcrypt.gensalt()
+        bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
     ).decode()
 
 
 def verify_password(password: str, hashed: str) -> bool:
+    import bcrypt
+
     return bcrypt.checkpw(
         password.encode(),
         hashed.encode()
     )
 
 
+class PasswordHashPool:
+    """
+    Runs bcrypt off the event loop on a dedicated pool. bcrypt releases the GIL,
+    so threads hash in parallel without the pickling cost of a process pool.
+    Admission is capped at workers + queue_depth; anything beyond fails fast
+    with a 503 instead of piling up behind a login storm.
+    """
+
+    def __init__(self, workers: int, queue_depth: int):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._limit = workers + queue_depth
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self._limit:
+                metrics.counter("password_hash.rejected").inc()
+                raise HTTPException(
+                    status_code=503,
+                    detail="Authentication is busy, please retry",
+                    headers={"Retry-After": "1"},
+                )
+            self._pending += 1
+            metrics.gauge("password_hash.pending").set(self._pending)
+
+        enqueued = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            metrics.histogram("password_hash.queue_wait_ms").observe((started - enqueued) * 1000)
+            try:
+                return fn(*args)
+            finally:
+                metrics.histogram("password_hash.latency_ms").observe((time.perf_counter() - started) * 1000)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, job)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                metrics.gauge("password_hash.pending").set(self._pending)
+
+
+password_pool = PasswordHashPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_DEPTH)
+
+
+async def hash_password_async(password: str) -> str:
+    return await password_pool.run(hash_password, password)
+
+
+async def verify_password_async(password: str, hashed: str) -> bool:
+    return await password_pool.run(verify_password, password, hashed)
+
+
 
 
 
@@ -61,30 +144,98 @@ def create_token(email: str) -> str:
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def decode_token(token: str) -> str | None:
+def decode_token_payload(token: str) -> dict | None:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload["sub"]  
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
 
 
+def decode_token(token: str) -> str | None:
+    payload = decode_token_payload(token)
+    return payload["sub"] if payload else None
+
+
+
+
+def _snapshot(row, exclude=()):
+    return SimpleNamespace(**{
+        col.key: getattr(row, col.key)
+        for col in row.__table__.columns
+        if col.key not in exclude
+    })
+
+
+async def load_principal(db: AsyncSession, email: str):
+    """
+    Loads the user and their profile in a single joined query and returns a
+    detached, read-only snapshot: `user.profile` is a plain namespace (or None).
+    Routes that write to the user/profile rows must query them explicitly.
+    """
+    row = (await db.execute(
+        select(User, ResourceVersion.version)
+        .outerjoin(ResourceVersion, and_(
+            ResourceVersion.user_id == User.id,
+            ResourceVersion.resource == versions.PROFILE,
+        ))
+        .options(joinedload(User.profile))
+        .where(User.email == email)
+    )).first()
+    if not row:
+        return None
+
+    user, profile_version = row
+    principal = _snapshot(user, exclude=_PRIVATE_USER_FIELDS)
+    principal.profile = _snapshot(user.profile) if user.profile else None
+    principal.profile_version = profile_version or 0
+    return principal
+
+
+def invalidate_principal(email: str):
+    principal_cache.discard_where(lambda _token, user: user.email == email)
+
 
+async def current_profile(db: AsyncSession, user):
+    """
+    The principal and its profile version as stored now. A cached principal
+    can predate a profile write served by another worker; its snapshot is
+    reloaded then, so the ETag and the body always describe the same version.
+    """
+    version = await versions.current(db, user.id, versions.PROFILE)
+    if version != user.profile_version:
+        invalidate_principal(user.email)
+        user = await load_principal(db, user.email) or user
+        version = user.profile_version
+    return user, version
 
-def get_current_user(
+
+async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(lambda: SessionLocal()),
+    db: AsyncSession = Depends(get_db),
 ):
-    email = decode_token(credentials.credentials)
-
-    if not email:
+    token = credentials.credentials
+    user = principal_cache.get(token)
+    if user is not None:
+        db.info["principal"] = user.email
+        return user
+
+    payload = decode_token_payload(token)
+    if not payload or not payload.get("sub"):
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
-    user = db.query(User).filter(User.email == email).first()
+    # Lets the routing session keep this principal on the primary after writes.
+    db.info["principal"] = payload["sub"]
+    user = await load_principal(db, payload["sub"])
 
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
 
+    ttl = principal_cache.ttl
+    if "exp" in payload:
+        ttl = min(ttl, payload["exp"] - time.time())
+    if ttl > 0:
+        principal_cache.set(token, user, ttl=ttl)
+
     return user
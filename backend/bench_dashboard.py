@@ -0,0 +1,78 @@
+"""
+Compares the aggregated /dashboard call with the fan-out the Dashboard page
+does today, against a running server.
+
+    python bench_dashboard.py --token <JWT> [--base-url http://localhost:8000]
+                              [--iterations 200] [--concurrency 20]
+
+Each fan-out iteration issues the page's requests the way the page does:
+/me, /plans/latest, /nutrition/logs/week and /sleep/today in parallel, then
+/plans/{id}/nutrition-plan once the plan id is known.
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+
+async def fan_out(client: httpx.AsyncClient):
+    _, plan, _, _ = await asyncio.gather(
+        client.get("/me"),
+        client.get("/plans/latest"),
+        client.get("/nutrition/logs/week"),
+        client.get("/sleep/today"),
+    )
+    if plan.status_code == 200:
+        await client.get(f"/plans/{plan.json()['id']}/nutrition-plan")
+
+
+async def aggregated(client: httpx.AsyncClient):
+    (await client.get("/dashboard")).raise_for_status()
+
+
+async def run(scenario, client, iterations: int, concurrency: int):
+    gate = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with gate:
+            started = time.perf_counter()
+            await scenario(client)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(iterations)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "p50_ms": round(latencies[len(latencies) // 2], 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 1),
+        "loads_per_s": round(iterations / wall, 1),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    async with httpx.AsyncClient(
+        base_url=args.base_url,
+        headers={"Authorization": f"Bearer {args.token}"},
+        timeout=30,
+    ) as client:
+        # Warm the principal cache and connection pools before timing.
+        await fan_out(client)
+        await aggregated(client)
+
+        for name, scenario in (("fan-out", fan_out), ("/dashboard", aggregated)):
+            print(f"{name:>12}: {await run(scenario, client, args.iterations, args.concurrency)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,31 @@
+"""
+Rendered chat context ([USER CONTEXT] / [LIVE STATUS] / [WEEKLY SCHEDULE])
+cached per user per day, so a conversation builds it once instead of on
+every message.
+
+Entries are keyed on the user's resource versions (versions.stamp over
+everything the block shows: profile, plans and workouts, nutrition and
+sleep logs). A write on any worker bumps one of them, so every worker stops
+using the old block on its next message; the superseded entries just age
+out.
+"""
+import os
+from datetime import date
+
+import metrics
+from cache import TTLCache
+
+_contexts = TTLCache(
+    maxsize=int(os.getenv("CHAT_CONTEXT_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("CHAT_CONTEXT_TTL", "300")),
+)
+
+
+def get(user_id: int, day: date, stamp: tuple):
+    context = _contexts.get((user_id, day, stamp))
+    metrics.counter("chat.context.hits" if context is not None else "chat.context.misses").inc()
+    return context
+
+
+def store(user_id: int, day: date, stamp: tuple, context: str):
+    _contexts.set((user_id, day, stamp), context)
@@ -0,0 +1,160 @@
+"""
+Server-side chat conversations. The client sends only the new message and
+the conversation id it got back from the first one; the history lives in
+chat_conversations / chat_messages.
+
+Compaction keeps the prompt bounded: once the stored turns pass
+CHAT_HISTORY_TOKENS, the oldest exchanges are folded into a short running
+summary (first sentence of each turn) and deleted. The summary itself is
+capped at CHAT_SUMMARY_TOKENS by dropping its oldest lines.
+
+A conversation row is only written once its first answer is; failed or
+rejected first messages leave nothing behind. Conversations idle for
+CHAT_RETENTION_DAYS are deleted by a periodic sweep.
+"""
+import asyncio
+import datetime
+import os
+import re
+import uuid
+
+from fastapi import HTTPException
+from sqlalchemy import delete, select
+from sqlalchemy.orm import selectinload
+
+from db import db_session
+from models import ChatConversation, ChatMessage
+
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "1500"))
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "300"))
+SUMMARY_LINE_CHARS = 200
+CHAT_RETENTION_DAYS = int(os.getenv("CHAT_RETENTION_DAYS", "30"))
+CHAT_SWEEP_INTERVAL_SECONDS = float(os.getenv("CHAT_SWEEP_INTERVAL_SECONDS", "3600"))
+
+ROLE_LABELS = {"user": "Athlete", "model": "Coach"}
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English; close enough for a budget.
+    return len(text or "") // 4 + 1
+
+
+def _role(role: str) -> str:
+    return "user" if role == "user" else "model"
+
+
+def _summary_line(message) -> str:
+    text = " ".join((message.content or "").split())
+    first = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0]
+    if len(first) > SUMMARY_LINE_CHARS:
+        first = first[:SUMMARY_LINE_CHARS - 1].rstrip() + "…"
+    return f"{ROLE_LABELS[_role(message.role)]}: {first}"
+
+
+def compact(conversation: ChatConversation):
+    """Fold the oldest turns into the summary until the rest fit the budget."""
+    messages = conversation.messages
+    used = sum(estimate_tokens(m.content) for m in messages)
+    folded = []
+    # Always keep the latest exchange verbatim, however long it is.
+    while used > CHAT_HISTORY_TOKENS and len(messages) > 2:
+        message = messages.pop(0)  # delete-orphan removes the row on flush
+        used -= estimate_tokens(message.content)
+        folded.append(_summary_line(message))
+
+    if not folded:
+        return
+    lines = (conversation.summary.splitlines() if conversation.summary else []) + folded
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > CHAT_SUMMARY_TOKENS:
+        lines.pop(0)
+    conversation.summary = "\n".join(lines)
+
+
+def _load(user_id: int, conversation_id: str):
+    return (
+        select(ChatConversation)
+        .options(selectinload(ChatConversation.messages))
+        .where(ChatConversation.id == conversation_id, ChatConversation.user_id == user_id)
+    )
+
+
+def _new(user_id: int, conversation_id: str, history) -> ChatConversation:
+    conversation = ChatConversation(id=conversation_id, user_id=user_id, messages=[])
+    for msg in history or []:
+        if isinstance(msg, dict) and msg.get("content"):
+            conversation.messages.append(ChatMessage(role=_role(msg.get("role")), content=str(msg["content"])))
+    compact(conversation)
+    return conversation
+
+
+async def open_conversation(db, user_id: int, conversation_id=None, history=None) -> ChatConversation:
+    """
+    The user's conversation with its stored turns, or a new, unsaved one
+    (seeded from `history` for clients that still send it). save_turn
+    writes the new one along with its first exchange.
+    """
+    if conversation_id:
+        conversation = await db.scalar(_load(user_id, conversation_id))
+        if not conversation:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        return conversation
+
+    return _new(user_id, uuid.uuid4().hex, history)
+
+
+def prompt_history(conversation: ChatConversation, message: str) -> list:
+    """Stored turns plus the new message, in the shape stream_gemini takes."""
+    turns = [{"role": m.role, "content": m.content} for m in conversation.messages]
+    return turns + [{"role": "user", "content": message}]
+
+
+def summary_block(conversation: ChatConversation) -> str:
+    """Appended to the system prompt when older turns have been compacted."""
+    if not conversation.summary:
+        return ""
+    lines = "\n".join(f"    {line}" for line in conversation.summary.splitlines())
+    return f"\n    [EARLIER IN THIS CONVERSATION]\n{lines}\n    "
+
+
+async def save_turn(db, user_id: int, conversation_id: str, message: str, reply: str, history=None):
+    """
+    Append a finished exchange and compact, creating the conversation (from
+    the same `history` open_conversation was given) on its first answer.
+    Failures are logged, not raised: the answer has already been given.
+    """
+    try:
+        conversation = await db.scalar(_load(user_id, conversation_id))
+        if not conversation:
+            conversation = _new(user_id, conversation_id, history)
+            db.add(conversation)
+        conversation.messages.append(ChatMessage(role="user", content=message))
+        conversation.messages.append(ChatMessage(role="model", content=reply))
+        conversation.updated_at = datetime.datetime.utcnow()
+        compact(conversation)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        print(f"Chat history save failed for conversation {conversation_id}: {e}")
+
+
+async def sweep_expired():
+    """Delete conversations nobody has written to for CHAT_RETENTION_DAYS."""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=CHAT_RETENTION_DAYS)
+    expired = select(ChatConversation.id).where(ChatConversation.updated_at < cutoff)
+    try:
+        async with db_session() as db:
+            await db.execute(delete(ChatMessage).where(ChatMessage.conversation_id.in_(expired)))
+            result = await db.execute(delete(ChatConversation).where(ChatConversation.updated_at < cutoff))
+            await db.commit()
+        if result.rowcount:
+            print(f"Chat retention sweep removed {result.rowcount} conversations")
+    except Exception as e:
+        print(f"Chat retention sweep failed: {e}")
+
+
+async def run_sweeper():
+    """Background loop started with the app. Every worker runs one; the
+    deletes are idempotent, so overlapping sweeps are harmless."""
+    while True:
+        await sweep_expired()
+        await asyncio.sleep(CHAT_SWEEP_INTERVAL_SECONDS)
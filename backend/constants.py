@@ -21,6 +21,56 @@ STRENGTH_LOADING_PROGRESSION = {
 DAYS_OF_WEEK = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
 
 
+# Endurance session shapes. Power is a fraction of FTP; the workout-file
+# compiler (services/workout_files.py) builds ZWO/ERG/MRC steps from these.
+EASY_POWER = 0.55
+
+INTERVAL_SETS = {
+    "interval": {
+        "warmup_min": 15,
+        "reps": 5,
+        "work_min": 5,
+        "work_power": (1.05, 1.20),
+        "zone": "Zone 5",
+        "rest_min": 3,
+        "rest_label": "intervals",
+        "cooldown_min": 10,
+    },
+    "tempo": {
+        "warmup_min": 15,
+        "reps": 3,
+        "work_min": 15,
+        "work_power": (0.85, 0.95),
+        "zone": "Zone 3",
+        "rest_min": 5,
+        "rest_label": "efforts",
+        "cooldown_min": 10,
+    },
+}
+
+STEADY_EFFORTS = {
+    "recovery": {"power": (0.45, 0.65), "effort": "Zone 1 only (<65% FTP)"},
+    "long": {"power": (0.65, 0.75), "effort": "Zone 2 steady (65-75% FTP)"},
+    "base": {"power": (0.65, 0.75), "effort": "Zone 2 steady (65-75% FTP)"},
+}
+
+
+def _pct(fraction: float) -> int:
+    return round(fraction * 100)
+
+
+def describe_interval_set(role_key: str, reps: Optional[int] = None) -> Dict:
+    spec = INTERVAL_SETS[role_key]
+    reps = reps or spec["reps"]
+    low, high = spec["work_power"]
+    return {
+        "warmup": f"{spec['warmup_min']} min easy",
+        "main_set": f"{reps} x {spec['work_min']}min @ {spec['zone']} ({_pct(low)}-{_pct(high)}% FTP)",
+        "recovery": f"{spec['rest_min']} min easy between {spec['rest_label']}",
+        "cooldown": f"{spec['cooldown_min']} min easy",
+    }
+
+
 class TrainingEngine:
     def __init__(self, profile: ProfileCreate, training_week: int = 1):
         self.profile = profile
@@ -239,39 +289,29 @@ class TrainingEngine:
         if role_key == "interval":
             
             description = "Build maximum aerobic capacity with short, intense efforts."
-            workout_structure = {
-                "warmup": "15 min easy",
-                "main_set": "5 x 5min @ Zone 5 (105-120% FTP)",
-                "recovery": "3 min easy between intervals",
-                "cooldown": "10 min easy"
-            }
+            workout_structure = describe_interval_set("interval")
         elif role_key == "tempo":
             
             description = "Build threshold power with sustained efforts at the upper edge of comfort."
-            workout_structure = {
-                "warmup": "15 min easy",
-                "main_set": "3 x 15min @ Zone 3 (85-95% FTP)",
-                "recovery": "5 min easy between efforts",
-                "cooldown": "10 min easy"
-            }
+            workout_structure = describe_interval_set("tempo")
         elif role_key == "recovery":
             description = "Very light spinning to promote blood flow and recovery. Should feel refreshing, not tiring."
             workout_structure = {
-                "effort": "Zone 1 only (<65% FTP)",
+                "effort": STEADY_EFFORTS["recovery"]["effort"],
                 "cadence": "High cadence (90-100 rpm), very low resistance",
                 "focus": "Active recovery, not training stress"
             }
         elif role_key == "long":
             description = "Long steady ride for aerobic base development. Practice nutrition and pacing."
             workout_structure = {
-                "effort": "Zone 2 steady (65-75% FTP)",
+                "effort": STEADY_EFFORTS["long"]["effort"],
                 "nutrition": "Practice race nutrition every 30-45 minutes",
                 "focus": "Aerobic endurance, fat oxidation, mental resilience"
             }
         elif role_key == "base":
             description = "Steady aerobic base work to accumulate volume without excess fatigue."
             workout_structure = {
-                "effort": "Zone 2 steady (65-75% FTP)",
+                "effort": STEADY_EFFORTS["base"]["effort"],
                 "focus": "Conversational pace, aerobic development"
             }
         
@@ -1,6 +1,19 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from contextlib import asynccontextmanager
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.sql.dml import UpdateBase
+from fastapi import Depends, Request
+from starlette.concurrency import run_in_threadpool
+import math
 import os
+import random
+import time
+
+import metrics
+from cache import TTLCache
 from dotenv import load_dotenv
 load_dotenv()
 DBkey = os.getenv("DATABASE_URL")
@@ -10,18 +23,330 @@ if not DBkey:
 
 DATABASE_URL = DBkey
 
-engine = create_engine(
-    DATABASE_URL,
-    pool_size=20,
-    max_overflow=40,
+# Comma-separated read replicas. Empty means everything uses the primary.
+REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+# After a user writes, their reads stay on the primary for this long so they
+# never see their own write missing because of replica lag.
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+
+# "async" runs every query on the async driver; "sync" keeps the psycopg2 engine
+# and hops each session call onto the threadpool. Routes are written once
+# against the AsyncSession API, so the two can be benchmarked side by side.
+DB_MODE = os.getenv("DB_MODE", "async").lower()
+
+if DB_MODE not in ("async", "sync"):
+    raise RuntimeError(f"DB_MODE must be 'async' or 'sync', got {DB_MODE!r}.")
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+UPSERT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+# Connections the whole deployment may hold against one database server,
+# shared by every worker process (WEB_CONCURRENCY, as read by uvicorn/gunicorn).
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "60"))
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+DB_POOL_WAIT_WARN_MS = float(os.getenv("DB_POOL_WAIT_WARN_MS", "100"))
+
+
+def pool_sizing(budget: int, workers: int) -> tuple:
+    """Splits a per-worker share of the budget into 1/3 steady pool, 2/3 overflow."""
+    per_worker = max(2, budget // workers)
+    pool_size = max(1, per_worker // 3)
+    return pool_size, per_worker - pool_size
+
+
+POOL_SIZE, MAX_OVERFLOW = pool_sizing(DB_CONNECTION_BUDGET, WEB_CONCURRENCY)
+
+POOL_OPTIONS = dict(
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
     pool_timeout=30,
     pool_pre_ping=True,
 )
 
+
+class InstrumentedPoolMixin:
+    """Times every checkout (queue wait + pre-ping) and counts pool timeouts."""
+
+    label = "primary"
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            metrics.counter(f"db.pool.{self.label}.timeouts").inc()
+            raise
+        finally:
+            waited_ms = (time.perf_counter() - started) * 1000
+            metrics.histogram(f"db.pool.{self.label}.checkout_wait_ms").observe(waited_ms)
+            if waited_ms > DB_POOL_WAIT_WARN_MS:
+                print(
+                    f"DB pool warning: {self.label} checkout waited {waited_ms:.0f}ms "
+                    f"(in use {self.checkedout()}/{POOL_SIZE}+{MAX_OVERFLOW})"
+                )
+
+
+def _pool_class(base, label: str):
+    # recreate() on dispose builds the same class again, so the label sticks.
+    return type(f"Instrumented{base.__name__}", (InstrumentedPoolMixin, base), {"label": label})
+
+
+def _track_pool_usage(sync_engine, label: str):
+    def update(returning: int):
+        pool = sync_engine.pool
+        metrics.gauge(f"db.pool.{label}.in_use").set(max(0, pool.checkedout() - returning))
+        metrics.gauge(f"db.pool.{label}.overflow").set(max(0, pool.overflow()))
+
+    # checkin fires before the connection is handed back to the pool.
+    event.listen(sync_engine, "checkout", lambda *_: update(0))
+    event.listen(sync_engine, "checkin", lambda *_: update(1))
+    metrics.gauge(f"db.pool.{label}.size").set(POOL_SIZE)
+    metrics.gauge(f"db.pool.{label}.max_overflow").set(MAX_OVERFLOW)
+
+
+def _create_engine(url: str, label: str):
+    engine = create_engine(url, poolclass=_pool_class(QueuePool, label), **POOL_OPTIONS)
+    _track_pool_usage(engine, label)
+    return engine
+
+
+engine = _create_engine(DATABASE_URL, "primary")
+replica_engines = [_create_engine(url, f"replica{i}") for i, url in enumerate(REPLICA_URLS)]
+
+# principal (JWT subject) -> recently wrote. Per process, like the principal
+# cache, so it only covers follow-up reads that land on the same worker; the
+# cookie below carries the same fact to every worker.
+recent_writers = TTLCache(maxsize=65536, ttl=REPLICA_STICKY_SECONDS)
+
+REPLICA_STICKY_COOKIE = "ironclad_wrote"
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class RoutingSession(Session):
+    """
+    Sends reads to a replica when the session was flagged read-only (see
+    use_replica) and the current principal hasn't written recently; flushes,
+    DML and everything else go to the primary.
+    """
+
+    primary = engine
+    replicas = replica_engines
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        writing = self._flushing or isinstance(clause, UpdateBase)
+        if writing:
+            self.info["wrote"] = True
+        elif (
+            self.replicas
+            and self.info.get("read_only")
+            and not self.info.get("wrote")
+            and recent_writers.get(self.info.get("principal")) is None
+        ):
+            return random.choice(self.replicas)
+        return self.primary
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _remember_writer(session):
+    if session.info.pop("wrote", False) and session.info.get("principal"):
+        recent_writers.set(session.info["principal"], True)
+
+
 SessionLocal = sessionmaker(
+    class_=RoutingSession,
     autocommit=False,
     autoflush=False,
-    bind=engine
 )
 
 Base = declarative_base()
+
+
+def to_async_url(url: str) -> str:
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f"No async driver configured for {backend!r}.")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+async_engine = None
+async_replica_engines = []
+AsyncSessionLocal = None
+
+if DB_MODE == "async":
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    def _create_async_engine(url: str, label: str):
+        async_engine = create_async_engine(
+            to_async_url(url),
+            poolclass=_pool_class(AsyncAdaptedQueuePool, label),
+            **POOL_OPTIONS,
+        )
+        _track_pool_usage(async_engine.sync_engine, label)
+        return async_engine
+
+    async_engine = _create_async_engine(DATABASE_URL, "primary")
+    async_replica_engines = [
+        _create_async_engine(url, f"replica{i}") for i, url in enumerate(REPLICA_URLS)
+    ]
+
+    class AsyncRoutingSession(RoutingSession):
+        # AsyncSession drives a sync Session underneath, which must be handed
+        # the sync facade of each async engine.
+        primary = async_engine.sync_engine
+        replicas = [e.sync_engine for e in async_replica_engines]
+
+    AsyncSessionLocal = async_sessionmaker(
+        sync_session_class=AsyncRoutingSession,
+        autoflush=False,
+        expire_on_commit=False,
+    )
+
+
+class ThreadedSession:
+    """
+    AsyncSession-shaped wrapper over a sync Session. Each call that can touch
+    the database runs on the threadpool; results come back fully buffered so
+    nothing fetches from the cursor on the event loop.
+    """
+
+    def __init__(self, session):
+        self.sync_session = session
+
+    @property
+    def info(self):
+        return self.sync_session.info
+
+    def get_bind(self, *args, **kw):
+        return self.sync_session.get_bind(*args, **kw)
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def execute(self, statement, params=None, **kw):
+        def run():
+            result = self.sync_session.execute(statement, params, **kw)
+            # DML without RETURNING has no rows to buffer and can't be frozen.
+            return result.freeze() if getattr(result, "returns_rows", True) else lambda: result
+
+        frozen = await run_in_threadpool(run)
+        return frozen()
+
+    async def scalar(self, statement, params=None, **kw):
+        return (await self.execute(statement, params, **kw)).scalar()
+
+    async def scalars(self, statement, params=None, **kw):
+        return (await self.execute(statement, params, **kw)).scalars()
+
+    async def get(self, entity, ident, **kw):
+        return await run_in_threadpool(self.sync_session.get, entity, ident, **kw)
+
+    async def flush(self, objects=None):
+        await run_in_threadpool(self.sync_session.flush, objects)
+
+    async def refresh(self, instance, attribute_names=None):
+        await run_in_threadpool(self.sync_session.refresh, instance, attribute_names)
+
+    async def delete(self, instance):
+        await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+
+async def get_db():
+    if DB_MODE == "async":
+        async with AsyncSessionLocal() as db:
+            yield db
+    else:
+        db = ThreadedSession(SessionLocal(expire_on_commit=False))
+        try:
+            yield db
+        finally:
+            await db.close()
+
+
+# Same session lifecycle as get_db, for work outside a request (background tasks).
+db_session = asynccontextmanager(get_db)
+
+
+async def upsert(db, model, values: dict, conflict_on: tuple):
+    """
+    INSERT ... ON CONFLICT (conflict_on) DO UPDATE ... RETURNING the row, as a
+    single statement. Every key in `values` outside the conflict target is
+    overwritten on conflict. Returns the resulting ORM instance.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect not in UPSERT_INSERTS:
+        raise RuntimeError(f"Upsert is not supported on {dialect!r}.")
+
+    stmt = UPSERT_INSERTS[dialect](model).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(conflict_on),
+        set_={key: stmt.excluded[key] for key in values if key not in conflict_on},
+    ).returning(model)
+
+    return await db.scalar(stmt, execution_options={"populate_existing": True})
+
+
+class ReplicaStickiness:
+    """
+    ASGI middleware: a successful unsafe request (POST, PUT, ...) gets a
+    short-lived cookie holding the write time, so the client's next reads
+    stay on the primary whichever worker serves them (see use_replica). Plain
+    ASGI rather than BaseHTTPMiddleware so streamed responses pass untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS or not REPLICA_URLS:
+            return await self.app(scope, receive, send)
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                cookie = (
+                    f"{REPLICA_STICKY_COOKIE}={time.time():.3f}; Max-Age={math.ceil(REPLICA_STICKY_SECONDS)}; "
+                    "Path=/; HttpOnly; SameSite=lax"
+                )
+                message["headers"] = [*message.get("headers", []), (b"set-cookie", cookie.encode())]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+
+def wrote_recently(request: Request) -> bool:
+    try:
+        wrote_at = float(request.cookies.get(REPLICA_STICKY_COOKIE, ""))
+    except ValueError:
+        return False
+    return time.time() - wrote_at < REPLICA_STICKY_SECONDS
+
+
+async def use_replica(request: Request, db=Depends(get_db)):
+    """
+    Route dependency marking the request's session as read-only, unless the
+    client wrote within REPLICA_STICKY_SECONDS (per its cookie).
+    """
+    if wrote_recently(request):
+        metrics.counter("db.replica.sticky_reads").inc()
+        return
+    db.info["read_only"] = True
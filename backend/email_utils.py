@@ -1,20 +1,29 @@
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
 
 load_dotenv()
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
-    MAIL_PASSWORD=os.getenv("MAIL_PASSWORD"),
-    MAIL_FROM=os.getenv("MAIL_FROM"),
-    MAIL_SERVER="smtp.gmail.com",
-    MAIL_PORT=587,
-    MAIL_STARTTLS=True,
-    MAIL_SSL_TLS=False,
-)
+
+@lru_cache(maxsize=1)
+def get_mailer():
+    from fastapi_mail import FastMail, ConnectionConfig
+
+    conf = ConnectionConfig(
+        MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
+        MAIL_PASSWORD=os.getenv("MAIL_PASSWORD"),
+        MAIL_FROM=os.getenv("MAIL_FROM"),
+        MAIL_SERVER="smtp.gmail.com",
+        MAIL_PORT=587,
+        MAIL_STARTTLS=True,
+        MAIL_SSL_TLS=False,
+    )
+    return FastMail(conf)
+
 
 async def send_verification_email(email: str, code: str):
+    from fastapi_mail import MessageSchema
+
     message = MessageSchema(
     subject="Verify your email",
     recipients=[email],
@@ -23,7 +32,6 @@ async def send_verification_email(email: str, code: str):
 )
 
 
-    fm = FastMail(conf)
-    await fm.send_message(message)
+    await get_mailer().send_message(message)
 
     print("Email send attempted")
@@ -0,0 +1,131 @@
+"""
+Local stand-in for the Gemini API, for exercising /chat and /chat/stream
+without network access or quota.
+
+    uvicorn fake_llm:app --port 8600
+    GEMINI_BASE_URL=http://127.0.0.1:8600 GOOGLE_API_KEY=fake uvicorn main:app
+
+Serves generateContent and streamGenerateContent (?alt=sse) in the wire
+format the google-genai client expects. Replies are deterministic: the last
+user message echoed back inside a fixed coaching sentence, padded to
+FAKE_LLM_TOKENS words. FAKE_LLM_TTFT_MS and FAKE_LLM_TOKEN_MS shape the
+timing so timeouts and time-to-first-token can be observed; the server
+logs (and counts, as fake_llm.abandoned_streams) when a client abandons a
+stream. generateContent with tools declared asks for function calls the
+way the in-process stub does (by keywords in the question), then answers
+from the function responses, so CHAT_MODE=tools can be driven through the
+real client too.
+
+This exercises the real client end to end; for load tests that shouldn't
+touch HTTP at all, LLM_BACKEND=stub (services/llm_gateway.py) answers in
+process instead.
+"""
+import asyncio
+import json
+import os
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+import metrics
+from services.llm_gateway import STUB_TOOL_KEYWORDS
+
+FAKE_LLM_TTFT_MS = float(os.getenv("FAKE_LLM_TTFT_MS", "300"))
+FAKE_LLM_TOKEN_MS = float(os.getenv("FAKE_LLM_TOKEN_MS", "20"))
+FAKE_LLM_TOKENS = int(os.getenv("FAKE_LLM_TOKENS", "60"))
+
+app = FastAPI()
+
+
+def reply_words(body: dict) -> list:
+    user_turns = [
+        c for c in body.get("contents", [])
+        if c.get("role") == "user" and "text" in c.get("parts", [{}])[0]
+    ]
+    question = user_turns[-1]["parts"][0]["text"] if user_turns else ""
+    words = f"Copy that. You asked: {question.strip()}. Stay on plan and recover well.".split()
+    while len(words) < FAKE_LLM_TOKENS:
+        words.append("Steady.")
+    return words[:max(FAKE_LLM_TOKENS, 1)]
+
+
+def response_chunk(text: str, final: bool, prompt_tokens: int, output_tokens: int) -> dict:
+    chunk = {
+        "candidates": [{
+            "content": {"role": "model", "parts": [{"text": text}]},
+            "index": 0,
+        }],
+        "modelVersion": "fake-llm",
+    }
+    if final:
+        chunk["candidates"][0]["finishReason"] = "STOP"
+        chunk["usageMetadata"] = {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens,
+        }
+    return chunk
+
+
+def tool_response(body: dict, n_prompt: int):
+    """A functionCall turn if the question wants tools it hasn't had yet, else None."""
+    offered = {
+        f["name"] for tool in body.get("tools") or [] for f in tool.get("functionDeclarations", [])
+    }
+    contents = body.get("contents", [])
+    asked = [i for i, c in enumerate(contents) if any("text" in p for p in c.get("parts", [])) and c.get("role") == "user"]
+    answered = any("functionResponse" in p for c in contents[asked[-1] + 1:] for p in c.get("parts", [])) if asked else False
+    question = contents[asked[-1]]["parts"][0]["text"].lower() if asked else ""
+    wanted = [name for name, words in STUB_TOOL_KEYWORDS.items() if name in offered and any(w in question for w in words)]
+    if not wanted or answered:
+        return None
+    chunk = response_chunk("", True, n_prompt, 0)
+    chunk["candidates"][0]["content"]["parts"] = [{"functionCall": {"name": name, "args": {}}} for name in wanted]
+    return chunk
+
+
+def tool_facts(body: dict) -> str:
+    return " ".join(
+        f"[{p['functionResponse']['name']}] {p['functionResponse']['response'].get('result')}"
+        for c in body.get("contents", []) for p in c.get("parts", []) if "functionResponse" in p
+    )
+
+
+def prompt_tokens(body: dict) -> int:
+    text = " ".join(p.get("text", "") for c in body.get("contents", []) for p in c.get("parts", []))
+    return len(text.split())
+
+
+@app.post("/{api_version}/models/{model_action}")
+async def models(api_version: str, model_action: str, request: Request):
+    body = await request.json()
+    _, _, action = model_action.partition(":")
+    words = reply_words(body)
+    n_prompt = prompt_tokens(body)
+
+    if action == "generateContent":
+        await asyncio.sleep((FAKE_LLM_TTFT_MS + FAKE_LLM_TOKEN_MS * len(words)) / 1000)
+        calls = tool_response(body, n_prompt)
+        if calls:
+            return calls
+        facts = tool_facts(body)
+        text = " ".join(words) + (f" {facts}" if facts else "")
+        return response_chunk(text, True, n_prompt, len(words))
+
+    async def sse():
+        sent = 0
+        try:
+            await asyncio.sleep(FAKE_LLM_TTFT_MS / 1000)
+            for i, word in enumerate(words):
+                if i:
+                    await asyncio.sleep(FAKE_LLM_TOKEN_MS / 1000)
+                final = i == len(words) - 1
+                text = word if i == 0 else " " + word
+                yield f"data: {json.dumps(response_chunk(text, final, n_prompt, i + 1))}\r\n\r\n"
+                sent += 1
+        finally:
+            if sent < len(words):
+                metrics.counter("fake_llm.abandoned_streams").inc()
+                print(f"fake_llm: client abandoned stream after {sent}/{len(words)} chunks")
+
+    return StreamingResponse(sse(), media_type="text/event-stream")
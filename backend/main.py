@@ -1,27 +1,41 @@
-from fastapi import FastAPI, Depends, HTTPException, Body, Response
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, Depends, HTTPException, Body, Header, Query, Request, Response, BackgroundTasks
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only, undefer
+from sqlalchemy.orm.attributes import set_committed_value
 from datetime import date, datetime, timedelta
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import desc
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, case, desc, insert, select
 from fastapi.encoders import jsonable_encoder
-from typing import Optional
-
-
-from db import Base, engine, SessionLocal
+from typing import List, Optional
+import asyncio
+import json
+import os
+import time
+
+
+import chat_context
+import chat_sessions
+import metrics
+import pdf_cache
+import pdf_render
+import versions
+import zip_stream
+from db import ReplicaStickiness, db_session, get_db, upsert, use_replica
 from models import (
     User, 
     UserProfile, 
     TrainingPlan, 
     DailyWorkout, 
     DailyNutritionLog, 
-    DailySleepLog
+    DailySleepLog,
+    load_plan_workouts,
 )
 
 
-from services.nutrition import NutritionCalculator
+from services import nutrition, retrieval, workout_files
 from services.generator import TrainingPlanGenerator 
-from services.GeminiLLM import chat_with_gemini
-from services.PDFGenerator import generate_weekly_pdf, generate_nutrition_pdf
+from services.llm_gateway import gateway as llm
 
 from schemas import (
     UserCreate,
@@ -40,17 +54,17 @@ from schemas import (
 )
 
 from auth import (
-    hash_password,
-    verify_password,
+    hash_password_async,
+    verify_password_async,
     create_token,
     generate_verification_code_with_expiration,
+    current_profile,
     get_current_user,
+    invalidate_principal,
 )
 from email_utils import send_verification_email
 
 
-Base.metadata.create_all(bind=engine)
-
 app = FastAPI()
 
 
@@ -65,21 +79,29 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
+app.add_middleware(ReplicaStickiness)
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+@app.on_event("shutdown")
+def stop_pdf_render_pool():
+    pdf_render.render_pool.shutdown()
+
+
+@app.on_event("startup")
+async def start_chat_sweeper():
+    app.state.chat_sweeper = asyncio.create_task(chat_sessions.run_sweeper())
+
 
+@app.on_event("shutdown")
+async def stop_chat_sweeper():
+    app.state.chat_sweeper.cancel()
 
 
 @app.post("/signup")
-async def signup(user: UserCreate, db: Session = Depends(get_db)):
-    existing_user = db.query(User).filter(User.email == user.email).first()
+async def signup(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    existing_user = await db.scalar(select(User).where(User.email == user.email))
 
     age = (date.today() - user.birthdate).days // 365
     if age < 15:
@@ -92,7 +114,7 @@ async def signup(user: UserCreate, db: Session = Depends(get_db)):
         code, expires_at = generate_verification_code_with_expiration()
         existing_user.verification_code = code
         existing_user.verification_expires_at = expires_at
-        db.commit()
+        await db.commit()
 
         try:
             await send_verification_email(existing_user.email, code)
@@ -104,7 +126,7 @@ async def signup(user: UserCreate, db: Session = Depends(get_db)):
     code, expires_at = generate_verification_code_with_expiration()
     new_user = User(
         email=user.email,
-        hashed_password=hash_password(user.password),
+        hashed_password=await hash_password_async(user.password),
         first_name=user.first_name,
         last_name=user.last_name,
         birthdate=user.birthdate,
@@ -114,7 +136,7 @@ async def signup(user: UserCreate, db: Session = Depends(get_db)):
     )
 
     db.add(new_user)
-    db.commit()
+    await db.commit()
 
     try:
         await send_verification_email(user.email, code)
@@ -124,10 +146,10 @@ async def signup(user: UserCreate, db: Session = Depends(get_db)):
     return {"message": "Signup successful. Check your email for verification code."}
 
 @app.post("/login")
-def login(user: UserLogin, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
+async def login(user: UserLogin, db: AsyncSession = Depends(get_db)):
+    db_user = await db.scalar(select(User).where(User.email == user.email))
 
-    if not db_user or not verify_password(user.password, db_user.hashed_password):
+    if not db_user or not await verify_password_async(user.password, db_user.hashed_password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
     if not db_user.is_verified:
@@ -137,8 +159,9 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
     return {"access_token": token}
 
 @app.post("/verify-email")
-def verify_email(data: VerifyEmailRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == data.email).first()
+async def verify_email(data: VerifyEmailRequest, db: AsyncSession = Depends(get_db)):
+    db.info["principal"] = data.email
+    user = await db.scalar(select(User).where(User.email == data.email))
 
     if not user:
         raise HTTPException(status_code=400, detail="Invalid request")
@@ -157,15 +180,16 @@ def verify_email(data: VerifyEmailRequest, db: Session = Depends(get_db)):
     user.verification_code = None
     user.verification_expires_at = None
     user.resend_available_at = None
-    db.commit()
+    await db.commit()
+    invalidate_principal(user.email)
 
     token = create_token(user.email)
     return {"access_token": token}
 
 
 @app.post("/resend-otp")
-async def resend_otp(data: ResendOTPRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == data.email).first()
+async def resend_otp(data: ResendOTPRequest, db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.email == data.email))
 
     if not user or user.is_verified:
         raise HTTPException(status_code=400, detail="Invalid request")
@@ -177,7 +201,7 @@ async def resend_otp(data: ResendOTPRequest, db: Session = Depends(get_db)):
     user.verification_code = code
     user.verification_expires_at = expires_at
     user.resend_available_at = datetime.utcnow() + timedelta(seconds=60)
-    db.commit()
+    await db.commit()
     
     try:
         await send_verification_email(user.email, code)
@@ -186,9 +210,25 @@ async def resend_otp(data: ResendOTPRequest, db: Session = Depends(get_db)):
 
     return {"message": "OTP resent"}
 
-@app.get("/me")
-def get_me(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    profile = db.query(UserProfile).filter(UserProfile.user_id == user.id).first()
+@app.get("/metrics")
+async def get_metrics():
+    # Metrics are per worker process; pid tells scrapes apart.
+    return {"pid": os.getpid(), **metrics.snapshot()}
+
+@app.get("/me", dependencies=[Depends(use_replica)])
+async def get_me(
+    response: Response,
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
+):
+    user, version = await current_profile(db, user)
+    tag = versions.etag(user.id, versions.PROFILE, version)
+    if versions.matches(if_none_match, tag):
+        return versions.not_modified(tag)
+    versions.tag_response(response, tag)
+
+    profile = user.profile
     return {
         "id": user.id,
         "email": user.email,
@@ -201,13 +241,12 @@ def get_me(user: User = Depends(get_current_user), db: Session = Depends(get_db)
 
 
 @app.post("/profile")
-def create_profile(
+async def create_profile(
     data: ProfileCreate,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    existing = db.query(UserProfile).filter(UserProfile.user_id == user.id).first()
-    if existing:
+    if user.profile:
          raise HTTPException(status_code=400, detail="Profile already exists")
 
     profile = UserProfile(
@@ -216,128 +255,328 @@ def create_profile(
         is_complete=True,
     )
     db.add(profile)
-    
-    user.profile_complete = True 
-    db.commit()
-    db.refresh(profile)
+    await versions.bump(db, user.id, versions.PROFILE)
+    await db.commit()
+    invalidate_principal(user.email)
+    nutrition.invalidate_user(user.id)
     return {"message": "Profile completed"}
 
-@app.get("/profile")
-def get_profile(
+@app.get("/profile", dependencies=[Depends(use_replica)])
+async def get_profile(
+    response: Response,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
 ):
-    profile = db.query(UserProfile).filter(UserProfile.user_id == user.id).first()
+    user, version = await current_profile(db, user)
+    profile = user.profile
     if not profile:
         raise HTTPException(status_code=404, detail="Profile not found")
+
+    tag = versions.etag(user.id, versions.PROFILE, version)
+    if versions.matches(if_none_match, tag):
+        return versions.not_modified(tag)
+    versions.tag_response(response, tag)
     return profile
 
 @app.put("/profile")
-def update_profile(
+async def update_profile(
     profile_data: ProfileCreate,
+    background_tasks: BackgroundTasks,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    existing_profile = db.query(UserProfile).filter(UserProfile.user_id == user.id).first()
+    existing_profile = await db.scalar(select(UserProfile).where(UserProfile.user_id == user.id))
     
     if not existing_profile:
         raise HTTPException(status_code=404, detail="Profile not found")
 
     update_data = profile_data.dict(exclude_unset=True)
+    targets_changed = any(
+        key in update_data and update_data[key] != getattr(existing_profile, key)
+        for key in nutrition.TARGET_INPUTS
+    )
     for key, value in update_data.items():
         setattr(existing_profile, key, value)
 
-    db.commit()
-    db.refresh(existing_profile)
+    await versions.bump(db, user.id, versions.PROFILE)
+    await db.commit()
+    invalidate_principal(user.email)
+    nutrition.invalidate_user(user.id)
+    if targets_changed:
+        background_tasks.add_task(nutrition.recompute_targets, user.id)
     
     return {"status": "success", "profile": existing_profile}
 
-@app.get("/profile/status")
-def profile_status(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    profile = db.query(UserProfile).filter(UserProfile.user_id == user.id).first()
+@app.get("/profile/status", dependencies=[Depends(use_replica)])
+async def profile_status(user: User = Depends(get_current_user)):
+    profile = user.profile
     return {"profile_exists": bool(profile and profile.is_complete)}
 
 
 
+def _insert_values(instance):
+    """Column values for a transient model, with scalar defaults filled in so
+    every row in a bulk insert carries the same keys."""
+    values = {}
+    for column in instance.__table__.columns:
+        if column.primary_key:
+            continue
+        if column.key in instance.__dict__:
+            values[column.key] = instance.__dict__[column.key]
+        elif column.default is None:
+            values[column.key] = None
+        elif column.default.is_scalar:
+            values[column.key] = column.default.arg
+    return values
+
+
+async def persist_plans(db: AsyncSession, generated: list):
+    """
+    Saves [(plan, workouts), ...] in two bulk INSERT ... RETURNING statements
+    (plans, then all workouts) inside the caller's transaction, regardless of
+    how many weeks are being written. Returns the plans with `workouts` set.
+    """
+    created_at = datetime.utcnow()
+    plan_rows = [{**_insert_values(plan), "created_at": created_at} for plan, _ in generated]
+    saved_plans = (await db.scalars(insert(TrainingPlan).returning(TrainingPlan), plan_rows)).all()
+
+    # RETURNING order isn't guaranteed for batched inserts; weeks in a block
+    # have distinct start dates, so match on that instead.
+    plans = sorted(saved_plans, key=lambda p: p.start_date)
+    plan_ids = {plan.start_date: plan.id for plan in plans}
+
+    workout_rows = [
+        {**_insert_values(workout), "plan_id": plan_ids[plan.start_date]}
+        for plan, workouts in generated
+        for workout in workouts
+    ]
+    # render_nulls keeps rest days (no time_of_day/modality) in the same batch.
+    saved_workouts = (await db.scalars(
+        insert(DailyWorkout)
+        .options(undefer(DailyWorkout.structure_json))
+        .returning(DailyWorkout),
+        workout_rows,
+        execution_options={"render_nulls": True},
+    )).all()
+
+    for workout in saved_workouts:
+        # SQL expression, not part of RETURNING.
+        set_committed_value(workout, "has_zwo", workout_files.supports(workout))
+
+    for plan in plans:
+        workouts = sorted((w for w in saved_workouts if w.plan_id == plan.id), key=lambda w: w.date)
+        set_committed_value(plan, "workouts", workouts)
+
+    return plans
+
+
+# Columns each reader of TrainingPlan.workouts actually touches.
+WORKOUT_RESPONSE_FIELDS = (
+    DailyWorkout.day_of_week,
+    DailyWorkout.date,
+    DailyWorkout.workout_type,
+    DailyWorkout.title,
+    DailyWorkout.estimated_duration_min,
+    DailyWorkout.is_rest_day,
+    DailyWorkout.actual_duration,
+    DailyWorkout.structure_json,
+    DailyWorkout.has_zwo,
+)
+WORKOUT_NUTRITION_FIELDS = (
+    DailyWorkout.date,
+    DailyWorkout.title,
+    DailyWorkout.workout_type,
+    DailyWorkout.estimated_duration_min,
+    DailyWorkout.is_rest_day,
+    DailyWorkout.time_of_day,
+    DailyWorkout.intensity_label,
+    DailyWorkout.target_calories,
+    DailyWorkout.target_protein,
+    DailyWorkout.target_carbs,
+    DailyWorkout.target_fats,
+    DailyWorkout.target_hydration_liters,
+    DailyWorkout.nutrition_timing,
+)
+WORKOUT_SCHEDULE_FIELDS = (
+    DailyWorkout.date,
+    DailyWorkout.day_of_week,
+    DailyWorkout.title,
+    DailyWorkout.completed,
+)
+WORKOUT_PDF_FIELDS = WORKOUT_NUTRITION_FIELDS + (DailyWorkout.structure_json,)
+WORKOUT_FILE_FIELDS = (
+    DailyWorkout.date,
+    DailyWorkout.title,
+    DailyWorkout.workout_type,
+    DailyWorkout.modality,
+    DailyWorkout.estimated_duration_min,
+    DailyWorkout.is_rest_day,
+    DailyWorkout.structure_json,
+)
+
+PLAN_RESPONSE_FIELDS = (
+    TrainingPlan.start_date,
+    TrainingPlan.end_date,
+    TrainingPlan.total_volume_minutes,
+    TrainingPlan.strength_volume_minutes,
+    TrainingPlan.endurance_volume_minutes,
+)
+
+
+def latest_plan_stmt(user_id: int, today: date, *options):
+    # The week containing today, newest generation first. Weeks generated
+    # together share created_at, so without a current week the newest block
+    # falls back to its earliest week.
+    is_current = and_(TrainingPlan.start_date <= today, TrainingPlan.end_date >= today)
+    return (
+        select(TrainingPlan)
+        .options(*options)
+        .where(TrainingPlan.user_id == user_id)
+        .order_by(case((is_current, 0), else_=1), desc(TrainingPlan.created_at), TrainingPlan.start_date)
+        .limit(1)
+    )
+
+
+def user_plan_stmt(user_id: int, plan_id: int, *options):
+    return (
+        select(TrainingPlan)
+        .options(*options)
+        .where(
+            TrainingPlan.id == plan_id,
+            TrainingPlan.user_id == user_id
+        )
+    )
+
+
+def todays_workout_id(user_id: int, today: date):
+    # Regenerated plans can overlap; the newest plan's session wins.
+    return (
+        select(DailyWorkout.id)
+        .join(TrainingPlan)
+        .where(TrainingPlan.user_id == user_id, DailyWorkout.date == today)
+        .order_by(desc(TrainingPlan.created_at))
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+async def fetch_plan(db: AsyncSession, stmt):
+    # unique() is required when workouts are joined-eager-loaded.
+    return (await db.execute(stmt)).unique().scalars().first()
+
+
 @app.post("/plans/generate", response_model=TrainingPlanResponse)
-def generate_plan(
+async def generate_plan(
     request: GeneratePlanRequest,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    profile = db.query(UserProfile).filter(UserProfile.user_id == user.id).first()
+    profile = user.profile
     if not profile or not profile.is_complete:
         raise HTTPException(status_code=400, detail="Profile setup required before generating a plan.")
 
-    generator = TrainingPlanGenerator(user_profile=profile, start_date=request.start_date)
-    plan_model, workout_models = generator.generate_plan()
-
-    plan_model.user_id = user.id
-    db.add(plan_model)
-    db.commit()      
-    db.refresh(plan_model)
-
-    for w in workout_models:
-        w.plan_id = plan_model.id 
-        db.add(w)
-    
-    db.commit()
-    return plan_model
-
-@app.get("/plans/latest", response_model=TrainingPlanResponse)
-def get_latest_plan(
+    calc = nutrition.get_calculator(profile, user)
+    generated = []
+    for week in range(request.weeks):
+        generator = TrainingPlanGenerator(
+            user_profile=profile,
+            start_date=request.start_date + timedelta(weeks=week),
+        )
+        plan_model, workout_models = generator.generate_plan()
+        plan_model.user_id = user.id
+        for workout in workout_models:
+            nutrition.store_targets(calc, workout)
+        generated.append((plan_model, workout_models))
+
+    plans = await persist_plans(db, generated)
+    await versions.bump(db, user.id, versions.PLANS)
+    await db.commit()
+    retrieval.invalidate(user.id)
+    return plans[0]
+
+@app.get("/plans/latest", response_model=TrainingPlanResponse, dependencies=[Depends(use_replica)])
+async def get_latest_plan(
+    response: Response,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
 ):
-    plan = (
-        db.query(TrainingPlan)
-        .filter(TrainingPlan.user_id == user.id)
-        .order_by(desc(TrainingPlan.created_at))
-        .first()
-    )
+    # Which week is current depends on the date, so the tag does too.
+    today = date.today()
+    tag = versions.etag(user.id, versions.PLANS, await versions.current(db, user.id, versions.PLANS), today.isoformat())
+    if versions.matches(if_none_match, tag):
+        return versions.not_modified(tag)
+
+    plan = await fetch_plan(db, latest_plan_stmt(
+        user.id,
+        today,
+        load_only(*PLAN_RESPONSE_FIELDS),
+        load_plan_workouts(*WORKOUT_RESPONSE_FIELDS),
+    ))
     
     if not plan:
         raise HTTPException(status_code=404, detail="No active plan found")
     
-    plan.workouts.sort(key=lambda x: x.date)
+    versions.tag_response(response, tag)
     return plan
 
-@app.get("/workouts/{workout_id}/zwo")
-def download_zwo(
+@app.get("/workouts/{workout_id}/zwo", dependencies=[Depends(use_replica)])
+async def download_zwo(
     workout_id: int, 
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    workout = db.query(DailyWorkout).join(TrainingPlan).filter(
-        DailyWorkout.id == workout_id,
-        TrainingPlan.user_id == user.id 
-    ).first()
+    return await download_workout_file(workout_id, "zwo", user, db)
+
+
+@app.get("/workouts/{workout_id}/file/{fmt}", dependencies=[Depends(use_replica)])
+async def download_workout_file(
+    workout_id: int,
+    fmt: str,
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Trainer file (zwo, erg or mrc) compiled from the workout's structure."""
+    if fmt not in workout_files.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Format must be one of {', '.join(workout_files.FORMATS)}")
+
+    workout = await db.scalar(
+        select(DailyWorkout).join(TrainingPlan).options(load_only(*WORKOUT_FILE_FIELDS)).where(
+            DailyWorkout.id == workout_id,
+            TrainingPlan.user_id == user.id 
+        )
+    )
     
     if not workout:
         raise HTTPException(status_code=404, detail="Workout not found or access denied")
         
-    if not workout.zwo_content:
-        raise HTTPException(status_code=400, detail="No ZWO file available for this workout type")
+    if not workout_files.supports(workout):
+        raise HTTPException(status_code=400, detail="No workout file available for this workout type")
+
+    ftp = workout_files.profile_ftp(user.profile)
+    if fmt == "erg" and not ftp:
+        raise HTTPException(status_code=400, detail="ERG files need an FTP in your profile")
 
-    filename = f"{workout.date}_{workout.title.replace(' ', '_')}.zwo"
-    
     return Response(
-        content=workout.zwo_content,
-        media_type="application/xml",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+        content=workout_files.compile_workout(workout, fmt, ftp),
+        media_type=workout_files.FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename={workout_files.filename(workout, fmt)}"}
     )
 
 @app.put("/workouts/{workout_id}/complete")
-def complete_workout(
+async def complete_workout(
     workout_id: int,
     data: CompleteWorkoutRequest,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    workout = db.query(DailyWorkout).join(TrainingPlan).filter(
-        DailyWorkout.id == workout_id,
-        TrainingPlan.user_id == user.id
-    ).first()
+    workout = await db.scalar(
+        select(DailyWorkout).join(TrainingPlan).where(
+            DailyWorkout.id == workout_id,
+            TrainingPlan.user_id == user.id
+        )
+    )
     
     if not workout:
         raise HTTPException(status_code=404, detail="Workout not found")
@@ -348,243 +587,353 @@ def complete_workout(
     workout.rpe = data.rpe
     workout.notes = data.notes
     
-    db.commit()
+    await versions.bump(db, user.id, versions.PLANS)
+    await db.commit()
+    retrieval.record(user.id, retrieval.workout_fact(workout))
     return {"status": "Workout logged successfully"}
 
 
 
-@app.get("/plans/{plan_id}/nutrition-plan")
-def get_nutrition_for_plan(
+@app.get("/plans/{plan_id}/nutrition-plan", dependencies=[Depends(use_replica)])
+async def get_nutrition_for_plan(
     plan_id: int,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    plan = db.query(TrainingPlan).filter(
-        TrainingPlan.id == plan_id, 
-        TrainingPlan.user_id == user.id
-    ).first()
+    plan = await fetch_plan(db, user_plan_stmt(
+        user.id, plan_id, load_plan_workouts(*WORKOUT_NUTRITION_FIELDS)
+    ))
     
     if not plan:
         raise HTTPException(status_code=404, detail="Plan not found")
 
-    profile = db.query(UserProfile).filter(UserProfile.user_id == user.id).first()
-    calc = NutritionCalculator(user_profile=profile, user=user)
-    results = []
-    
-    workouts = sorted(plan.workouts, key=lambda x: x.date)
-    for workout in workouts:
-        daily_data = calc.calculate_daily_needs(workout)
-        results.append(daily_data)
-        
-    return results
+    return [nutrition.needs_for(user.profile, user, workout) for workout in plan.workouts]
 
 @app.post("/nutrition/log")
-def log_daily_nutrition(
+async def log_daily_nutrition(
     log_data: LogNutrition,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    start = datetime.combine(log_data.date, datetime.min.time())
-    end = start + timedelta(days=1)
-
-    existing_log = db.query(DailyNutritionLog).filter(
-        DailyNutritionLog.user_id == user.id,
-        DailyNutritionLog.date >= start,
-        DailyNutritionLog.date < end
-    ).first()
-
-    if existing_log:
-        
-        existing_log.protein_consumed = log_data.protein
-        existing_log.carbs_consumed = log_data.carbs
-        existing_log.fats_consumed = log_data.fats
-        existing_log.water_liters = log_data.water
-        existing_log.calories_consumed = log_data.calories 
-    else:
-        
-        new_log = DailyNutritionLog(
-            user_id=user.id,
-            date=start, 
-            protein_consumed=log_data.protein,
-            carbs_consumed=log_data.carbs,
-            fats_consumed=log_data.fats,
-            water_liters=log_data.water,
-            calories_consumed=log_data.calories 
-        )
-        db.add(new_log)
-
-    db.commit()
-    return {"status": "Logged successfully"}
-
-@app.get("/nutrition/logs/week")
-def get_weekly_logs(
+    log = await upsert(
+        db,
+        DailyNutritionLog,
+        {
+            "user_id": user.id,
+            "date": log_data.date,
+            "protein_consumed": log_data.protein,
+            "carbs_consumed": log_data.carbs,
+            "fats_consumed": log_data.fats,
+            "water_liters": log_data.water,
+            "calories_consumed": log_data.calories,
+            "updated_at": datetime.utcnow(),
+        },
+        conflict_on=("user_id", "date"),
+    )
+    await versions.bump(db, user.id, versions.NUTRITION)
+    await db.commit()
+    retrieval.record(user.id, retrieval.nutrition_fact(log))
+    return {"status": "Logged successfully", "log": log}
+
+@app.get("/nutrition/logs/week", dependencies=[Depends(use_replica)])
+async def get_weekly_logs(
+    response: Response,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
 ):
-    logs = db.query(DailyNutritionLog).filter(
-        DailyNutritionLog.user_id == user.id
-    ).order_by(DailyNutritionLog.date.desc()).limit(14).all()
+    tag = versions.etag(user.id, versions.NUTRITION, await versions.current(db, user.id, versions.NUTRITION))
+    if versions.matches(if_none_match, tag):
+        return versions.not_modified(tag)
+    versions.tag_response(response, tag)
+
+    logs = (await db.scalars(
+        select(DailyNutritionLog).where(
+            DailyNutritionLog.user_id == user.id
+        ).order_by(DailyNutritionLog.date.desc()).limit(14)
+    )).all()
     return logs
 
 
 
 @app.post("/sleep/log")
-def log_sleep(
+async def log_sleep(
     log_data: SleepLogCreate,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    existing_log = db.query(DailySleepLog).filter(
-        DailySleepLog.user_id == user.id,
-        DailySleepLog.date == log_data.date
-    ).first()
-
-    if existing_log:
-        for key, value in log_data.dict().items():
-            setattr(existing_log, key, value)
-    else:
-        new_log = DailySleepLog(user_id=user.id, **log_data.dict())
-        db.add(new_log)
-    
-    db.commit()
-    return {"status": "Sleep logged successfully"}
+    log = await upsert(
+        db,
+        DailySleepLog,
+        {"user_id": user.id, **log_data.dict()},
+        conflict_on=("user_id", "date"),
+    )
+    await versions.bump(db, user.id, versions.SLEEP)
+    await db.commit()
+    retrieval.record(user.id, retrieval.sleep_fact(log))
+    return {"status": "Sleep logged successfully", "log": log}
 
-@app.get("/sleep/today", response_model=Optional[SleepLogResponse])
-def get_todays_sleep(
+@app.get("/sleep/today", response_model=Optional[SleepLogResponse], dependencies=[Depends(use_replica)])
+async def get_todays_sleep(
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     today = date.today()
-    log = db.query(DailySleepLog).filter(
-        DailySleepLog.user_id == user.id,
-        DailySleepLog.date == today
-    ).first()
+    log = await db.scalar(
+        select(DailySleepLog).where(
+            DailySleepLog.user_id == user.id,
+            DailySleepLog.date == today
+        )
+    )
     return log
 
-@app.get("/sleep/history")
-def get_sleep_history(
+@app.get("/sleep/history", dependencies=[Depends(use_replica)])
+async def get_sleep_history(
+    response: Response,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
 ):
     """Fetches sleep logs for the last 7 days."""
     today = date.today()
+
+    # The 7-day window moves at midnight even without writes.
+    version = await versions.current(db, user.id, versions.SLEEP)
+    tag = versions.etag(user.id, versions.SLEEP, version, today.isoformat())
+    if versions.matches(if_none_match, tag):
+        return versions.not_modified(tag)
+    versions.tag_response(response, tag)
     start_date = today - timedelta(days=6)
     
-    logs = db.query(DailySleepLog).filter(
-        DailySleepLog.user_id == user.id,
-        DailySleepLog.date >= start_date
-    ).order_by(DailySleepLog.date).all()
+    logs = (await db.scalars(
+        select(DailySleepLog).where(
+            DailySleepLog.user_id == user.id,
+            DailySleepLog.date >= start_date
+        ).order_by(DailySleepLog.date)
+    )).all()
     
     return logs
 
 
-@app.post("/chat")
-def chat_endpoint(
-    req: ChatRequest,
+DEFAULT_NUTRITION_TARGETS = {"calories": 2000, "protein": 150, "carbs": 200, "fats": 60}
+
+
+@app.get("/dashboard", response_model=DashboardStatsResponse, dependencies=[Depends(use_replica)])
+async def get_dashboard(
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    def format_time(seconds):
-        if not seconds: return "0m"
-        m = seconds // 60
-        s = seconds % 60
-        return f"{m}m {s}s"
-
-    
+    """Today's workout, nutrition and sleep in one round trip (the profile
+    already rides along with the cached principal)."""
     today = date.today()
-    profile = db.query(UserProfile).filter(UserProfile.user_id == user.id).first()
-    
-    daily_workout = db.query(DailyWorkout).join(TrainingPlan).filter(
-        TrainingPlan.user_id == user.id,
-        DailyWorkout.date == today
-    ).first()
-    
-    daily_log = db.query(DailyNutritionLog).filter(
-        DailyNutritionLog.user_id == user.id,
-        DailyNutritionLog.date == today
-    ).first()
-    
-    
-    sleep_log = db.query(DailySleepLog).filter(
-        DailySleepLog.user_id == user.id,
-        DailySleepLog.date == today
-    ).first()
 
-    nut_targets = None
-    if daily_workout:
-        calc = NutritionCalculator(user_profile=profile, user=user)
-        nut_targets = calc.calculate_daily_needs(daily_workout)["targets"]
+    row = (await db.execute(
+        select(DailyWorkout, DailyNutritionLog, DailySleepLog)
+        .select_from(User)
+        .outerjoin(DailyWorkout, DailyWorkout.id == todays_workout_id(user.id, today))
+        .outerjoin(DailyNutritionLog, and_(
+            DailyNutritionLog.user_id == User.id,
+            DailyNutritionLog.date == today,
+        ))
+        .outerjoin(DailySleepLog, and_(
+            DailySleepLog.user_id == User.id,
+            DailySleepLog.date == today,
+        ))
+        .options(
+            load_only(*WORKOUT_NUTRITION_FIELDS, DailyWorkout.completed, DailyWorkout.actual_duration),
+            load_only(
+                DailyNutritionLog.calories_consumed,
+                DailyNutritionLog.protein_consumed,
+                DailyNutritionLog.carbs_consumed,
+                DailyNutritionLog.fats_consumed,
+            ),
+            load_only(DailySleepLog.total_hours),
+        )
+        .where(User.id == user.id)
+    )).first()
+    workout, nutrition_log, sleep_log = row if row else (None, None, None)
+
+    targets = DEFAULT_NUTRITION_TARGETS
+    if workout and user.profile:
+        targets = nutrition.needs_for(user.profile, user, workout)["targets"]
+
+    return DashboardStatsResponse(
+        calories_consumed=nutrition_log.calories_consumed if nutrition_log else 0,
+        calories_target=targets["calories"],
+        protein_consumed=nutrition_log.protein_consumed if nutrition_log else 0,
+        protein_target=targets["protein"],
+        carbs_consumed=nutrition_log.carbs_consumed if nutrition_log else 0,
+        carbs_target=targets["carbs"],
+        fats_consumed=nutrition_log.fats_consumed if nutrition_log else 0,
+        fats_target=targets["fats"],
+        sleep_hours=sleep_log.total_hours if sleep_log else 0.0,
+        # actual_duration is recorded in seconds by the session timer.
+        workout_minutes=(workout.actual_duration or 0) // 60 if workout else 0,
+        workout_target_minutes=workout.estimated_duration_min if workout else 0,
+        workout_completed=bool(workout and workout.completed),
+    )
 
-    active_plan = db.query(TrainingPlan).filter(TrainingPlan.user_id == user.id).order_by(desc(TrainingPlan.created_at)).first()
-    
-    
-    weekly_context = "No active plan."
-    if active_plan:
-        sorted_workouts = sorted(active_plan.workouts, key=lambda x: x.date)
-        lines = []
-        for w in sorted_workouts:
-            marker = "⬅️ TODAY" if w.date == today else ""
-            status = "DONE" if w.completed else "TODO"
-            lines.append(f"{w.day_of_week}: {w.title} [{status}] {marker}")
-        weekly_context = "\n".join(lines)
 
-    
-    if daily_workout:
-        if daily_workout.completed and daily_workout.actual_duration:
-            actual_fmt = format_time(daily_workout.actual_duration)
-            workout_desc = f"{daily_workout.title} (DONE). Actual Time: {actual_fmt} (Target: {daily_workout.estimated_duration_min}m). RPE: {daily_workout.rpe}/10"
-        else:
-            workout_desc = f"{daily_workout.title} (TODO). Target: {daily_workout.estimated_duration_min}m"
-    else:
-        workout_desc = "Rest Day"
-    
-    
-    t_cals = nut_targets['calories'] if nut_targets else 2000
-    t_prot = nut_targets['protein'] if nut_targets else 150
-    t_carbs = nut_targets['carbs'] if nut_targets else 200
-    t_fats = nut_targets['fats'] if nut_targets else 60
-    
-    l_prot = daily_log.protein_consumed if daily_log else 0
-    l_carbs = daily_log.carbs_consumed if daily_log else 0
-    l_fats = daily_log.fats_consumed if daily_log else 0
-    l_water = daily_log.water_liters if daily_log else 0
-    l_cals = daily_log.calories_consumed if daily_log else 0 
-
-    nutrition_desc = (
-        f"Calories: {l_cals}/{t_cals}kcal | "
-        f"Macros: P:{l_prot}/{t_prot}g, C:{l_carbs}/{t_carbs}g, F:{l_fats}/{t_fats}g | "
-        f"Water: {l_water}L"
-    )
+def format_time(seconds):
+    if not seconds: return "0m"
+    m = seconds // 60
+    s = seconds % 60
+    return f"{m}m {s}s"
+
+
+class ChatTools:
+    """
+    The chat's context lookups, each run at most once per request. The
+    context prompt renders all of them; in tools mode the model calls only
+    the ones it needs. Without a `db`, every lookup opens its own short
+    session, so no connection is held while the model thinks.
+    """
+
+    DECLARATIONS = [
+        {"name": "get_sleep", "description": "Last night's sleep: total hours and REM/deep/core/awake breakdown."},
+        {"name": "get_today_workout", "description": "Today's session: title, target duration, and actual time and RPE once done."},
+        {"name": "get_nutrition_remaining", "description": "Calories, macros and water logged today against today's targets."},
+        {"name": "get_week_schedule", "description": "Training phase and this week's sessions, each marked DONE or TODO."},
+    ]
+
+    def __init__(self, user, today: date, db: Optional[AsyncSession] = None):
+        self.user = user
+        self.today = today
+        self.db = db
+        self._results = {}
+
+    async def _once(self, name, load):
+        if name not in self._results:
+            self._results[name] = await load()
+        return self._results[name]
+
+    async def _query(self, run):
+        if self.db is not None:
+            return await run(self.db)
+        async with db_session() as db:
+            return await run(db)
+
+    def _scalar(self, stmt):
+        return self._query(lambda db: db.scalar(stmt))
+
+    def _workout(self):
+        # Same row /dashboard shows when regenerated plans overlap today.
+        return self._once("workout", lambda: self._scalar(
+            select(DailyWorkout).where(DailyWorkout.id == todays_workout_id(self.user.id, self.today))
+        ))
+
+    def _plan(self):
+        return self._once("plan", lambda: self._query(lambda db: fetch_plan(db, latest_plan_stmt(
+            self.user.id, self.today, load_plan_workouts(*WORKOUT_SCHEDULE_FIELDS)
+        ))))
+
+    async def get_sleep(self) -> str:
+        sleep_log = await self._once("sleep", lambda: self._scalar(
+            select(DailySleepLog).where(
+                DailySleepLog.user_id == self.user.id,
+                DailySleepLog.date == self.today
+            )
+        ))
+        if not sleep_log:
+            return "No sleep logged for last night."
 
-    
-    if sleep_log:
         def fmt(val): return f"{val}h" if val is not None else "N/A"
-        sleep_desc = (
+        return (
             f"Total: {sleep_log.total_hours}h "
             f"(REM: {fmt(sleep_log.rem_hours)}, Deep: {fmt(sleep_log.deep_hours)}, "
             f"Core: {fmt(sleep_log.core_hours)}, Awake: {fmt(sleep_log.awake_hours)})"
         )
-    else:
-        sleep_desc = "No sleep logged for last night."
 
-    
-    user_goal = getattr(profile, 'primary_endurance', "General Fitness")
+    async def get_today_workout(self) -> str:
+        daily_workout = await self._workout()
+        if not daily_workout:
+            return "Rest Day"
+        if daily_workout.completed and daily_workout.actual_duration:
+            actual_fmt = format_time(daily_workout.actual_duration)
+            return f"{daily_workout.title} (DONE). Actual Time: {actual_fmt} (Target: {daily_workout.estimated_duration_min}m). RPE: {daily_workout.rpe}/10"
+        return f"{daily_workout.title} (TODO). Target: {daily_workout.estimated_duration_min}m"
+
+    async def get_nutrition_remaining(self) -> str:
+        daily_workout = await self._workout()
+        daily_log = await self._once("nutrition", lambda: self._scalar(
+            select(DailyNutritionLog).where(
+                DailyNutritionLog.user_id == self.user.id,
+                DailyNutritionLog.date == self.today
+            )
+        ))
+
+        nut_targets = None
+        if daily_workout:
+            nut_targets = nutrition.needs_for(self.user.profile, self.user, daily_workout)["targets"]
+        nut_targets = nut_targets or DEFAULT_NUTRITION_TARGETS
+
+        l_prot = daily_log.protein_consumed if daily_log else 0
+        l_carbs = daily_log.carbs_consumed if daily_log else 0
+        l_fats = daily_log.fats_consumed if daily_log else 0
+        l_water = daily_log.water_liters if daily_log else 0
+        l_cals = daily_log.calories_consumed if daily_log else 0
+
+        return (
+            f"Calories: {l_cals}/{nut_targets['calories']}kcal | "
+            f"Macros: P:{l_prot}/{nut_targets['protein']}g, C:{l_carbs}/{nut_targets['carbs']}g, "
+            f"F:{l_fats}/{nut_targets['fats']}g | "
+            f"Water: {l_water}L"
+        )
 
-    system_prompt = f"""
-    You are Ironclad AI, a highly intelligent and adaptive tactical performance coach.
-    
+    async def phase(self) -> str:
+        active_plan = await self._plan()
+        return active_plan.phase if active_plan else 'Maintenance'
+
+    async def weekly_schedule(self) -> str:
+        active_plan = await self._plan()
+        if not active_plan:
+            return "No active plan."
+        lines = []
+        for w in active_plan.workouts:
+            marker = "⬅️ TODAY" if w.date == self.today else ""
+            status = "DONE" if w.completed else "TODO"
+            lines.append(f"{w.day_of_week}: {w.title} [{status}] {marker}")
+        return "\n".join(lines)
+
+    async def get_week_schedule(self) -> str:
+        return f"Current Phase: {await self.phase()}\n{await self.weekly_schedule()}"
+
+    async def run(self, name: str) -> str:
+        """Tool-call entry point; a failed lookup is reported to the model, not raised."""
+        if name not in {d["name"] for d in self.DECLARATIONS}:
+            return f"Unknown tool {name}."
+        try:
+            return await getattr(self, name)()
+        except Exception as e:
+            print(f"Chat tool {name} failed: {e!r}")
+            return "Unavailable right now."
+
+
+async def render_chat_context(user, db: AsyncSession, today: date) -> str:
+    """The [USER CONTEXT] through [WEEKLY SCHEDULE] part of the chat prompt."""
+    tools = ChatTools(user, today, db)
+    user_goal = getattr(user.profile, 'primary_endurance', "General Fitness")
+
+    return f"""
     [USER CONTEXT]
     Goal: {user_goal}
-    Current Phase: {active_plan.phase if active_plan else 'Maintenance'}
+    Current Phase: {await tools.phase()}
     
     [LIVE STATUS FOR {today}]
-    • Sleep (Last Night): {sleep_desc}
-    • Training: {workout_desc}
-    • Nutrition: {nutrition_desc}
+    • Sleep (Last Night): {await tools.get_sleep()}
+    • Training: {await tools.get_today_workout()}
+    • Nutrition: {await tools.get_nutrition_remaining()}
     
     [WEEKLY SCHEDULE]
-    {weekly_context}
-    
+    {await tools.weekly_schedule()}
+    """
+
+
+CHAT_PERSONA = """
+    You are Ironclad AI, a highly intelligent and adaptive tactical performance coach.
+    """
+
+CHAT_INSTRUCTIONS = """
     [INSTRUCTIONS]
     1. **Be Responsive:** Do NOT output a status report unless asked. Answer only what the user asks.
     2. **Use Context Implicitly:** - If the user says "I'm tired", check the sleep data. If sleep was low, suggest a nap or lighter session.
@@ -593,70 +942,287 @@ def chat_endpoint(
     3. **Tone:** Concise, professional, elite military/athlete coach style. No fluff.
     """
 
-    full_history = req.history + [{"role": "user", "content": req.message}]
-    response_text = chat_with_gemini(system_prompt, full_history)
+CHAT_TOOL_INSTRUCTIONS = """
+    [INSTRUCTIONS]
+    1. **Be Responsive:** Do NOT output a status report unless asked. Answer only what the user asks.
+    2. **Fetch Only What You Need:** Live data comes from tools; call only the ones the question needs, and none for small talk.
+       - "I'm tired" -> get_sleep. If sleep was low, suggest a nap or lighter session.
+       - "What should I eat?" -> get_nutrition_remaining, and compare remaining macros AND calories.
+       - "How was my run?" -> get_today_workout, and compare Actual Time vs Target Time.
+       - Questions about the week or phase -> get_week_schedule.
+    3. **Tone:** Concise, professional, elite military/athlete coach style. No fluff.
+    """
+
+# "context" renders today's status into every prompt; "tools" lets the
+# model fetch it on demand (see ChatTools).
+CHAT_MODE = os.getenv("CHAT_MODE", "context").lower()
+if CHAT_MODE not in ("context", "tools"):
+    raise RuntimeError("CHAT_MODE must be 'context' or 'tools'.")
+
+# Everything a chat answer can draw on; their versions key the answer cache.
+CHAT_RESOURCES = (versions.PROFILE, versions.PLANS, versions.NUTRITION, versions.SLEEP)
+
+
+async def build_chat_prompt(user, db: AsyncSession, conversation, stamp: tuple, history: str = "") -> str:
+    """
+    System prompt shared by /chat and /chat/stream. The context block is
+    cached per user, day and version `stamp` (see chat_context); only a miss
+    queries.
+    `history` is the retrieved [RELEVANT HISTORY] block for this question.
+    """
+    today = date.today()
+    context = chat_context.get(user.id, today, stamp)
+    if context is None:
+        context = await render_chat_context(user, db, today)
+        chat_context.store(user.id, today, stamp, context)
+    return CHAT_PERSONA + context + history + chat_sessions.summary_block(conversation) + CHAT_INSTRUCTIONS
+
+
+def build_tool_prompt(user, conversation, history: str = "") -> str:
+    """Tools-mode system prompt: no queries, the model asks for what it needs."""
+    user_goal = getattr(user.profile, 'primary_endurance', "General Fitness")
+    context = f"""
+    [USER CONTEXT]
+    Goal: {user_goal}
+    Today: {date.today()}
+    """
+    return CHAT_PERSONA + context + history + chat_sessions.summary_block(conversation) + CHAT_TOOL_INSTRUCTIONS
+
+
+async def chat_setup(user, db: AsyncSession, conversation, question: str):
+    """(system prompt, tools or None, version stamp) for the configured
+    CHAT_MODE, with the past facts most relevant to `question` (see
+    services/retrieval). The stamp keys the gateway's answer cache, so a
+    write on any worker retires answers built from the old data."""
+    stamp = await versions.stamp(db, user.id, *CHAT_RESOURCES)
+    if stamp[0] != user.profile_version:
+        # The cached principal predates a profile write on another worker.
+        user, _ = await current_profile(db, user)
+    history = retrieval.history_block(await retrieval.relevant_facts(db, user.id, question))
+    if CHAT_MODE == "tools":
+        return build_tool_prompt(user, conversation, history), ChatTools(user, date.today()), stamp
+    return await build_chat_prompt(user, db, conversation, stamp, history), None, stamp
+
+
+@app.post("/chat")
+async def chat_endpoint(
+    req: ChatRequest,
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    conversation = await chat_sessions.open_conversation(db, user.id, req.conversation_id, req.history)
+    system_prompt, tools, stamp = await chat_setup(user, db, conversation, req.message)
+    full_history = chat_sessions.prompt_history(conversation, req.message)
+    llm.admit(user.id, system_prompt, full_history, stamp)
+
+    response_text = await llm.complete(user.id, system_prompt, full_history, tools=tools, stamp=stamp)
+    await chat_sessions.save_turn(db, user.id, conversation.id, req.message, response_text, req.history)
     
-    return {"response": response_text}
-@app.get("/plans/{plan_id}/export/pdf")
-def export_plan_pdf(
+    return {"response": response_text, "conversation_id": conversation.id}
+
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(
+    req: ChatRequest,
+    request: Request,
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Same answer as /chat, as server-sent events: `data: {"delta": ...}` per
+    chunk, then `event: done` carrying the conversation_id (or `event:
+    error`). Stops generating upstream as soon as the client goes
+    away; an abandoned answer isn't added to the conversation.
+    """
+    conversation = await chat_sessions.open_conversation(db, user.id, req.conversation_id, req.history)
+    system_prompt, tools, stamp = await chat_setup(user, db, conversation, req.message)
+    full_history = chat_sessions.prompt_history(conversation, req.message)
+    llm.admit(user.id, system_prompt, full_history, stamp)
+    conversation_id = conversation.id
+
+    async def events():
+        started = time.perf_counter()
+        first_token = True
+        chunks = []
+        upstream = llm.stream(user.id, system_prompt, full_history, tools=tools, stamp=stamp)
+        try:
+            async for chunk in upstream:
+                if first_token:
+                    metrics.histogram("chat.stream.ttft_ms").observe((time.perf_counter() - started) * 1000)
+                    first_token = False
+                chunks.append(chunk)
+                yield sse_event({"delta": chunk})
+                if await request.is_disconnected():
+                    metrics.counter("chat.stream.disconnects").inc()
+                    return
+            # The request's session is gone once streaming starts.
+            async with db_session() as session:
+                await chat_sessions.save_turn(session, user.id, conversation_id, req.message, "".join(chunks), req.history)
+            yield sse_event({"conversation_id": conversation_id}, event="done")
+        except HTTPException as e:
+            # Gateway failures (busy, circuit open, timeout, upstream error).
+            metrics.counter("chat.stream.errors").inc()
+            yield sse_event({"detail": e.detail, "status": e.status_code}, event="error")
+        except asyncio.CancelledError:
+            metrics.counter("chat.stream.disconnects").inc()
+            raise
+        finally:
+            await upstream.aclose()
+            metrics.histogram("chat.stream.duration_ms").observe((time.perf_counter() - started) * 1000)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def pdf_response(cached, filename: str, if_none_match: Optional[str]):
+    if versions.matches(if_none_match, cached.etag):
+        # Disk hits hold an open file; a 304 never reads it.
+        close = getattr(cached.chunks, "close", None)
+        if close:
+            close()
+        return versions.not_modified(cached.etag)
+
+    return StreamingResponse(
+        cached.chunks,
+        media_type="application/pdf",
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            "Content-Length": str(cached.size),
+            "ETag": cached.etag,
+            **versions.CACHE_HEADERS,
+        }
+    )
+
+
+@app.get("/plans/{plan_id}/export/pdf", dependencies=[Depends(use_replica)])
+async def export_plan_pdf(
     plan_id: int,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
 ):
-    plan = db.query(TrainingPlan).filter(
-        TrainingPlan.id == plan_id,
-        TrainingPlan.user_id == user.id
-    ).first()
+    plan = await fetch_plan(db, user_plan_stmt(
+        user.id, plan_id, load_plan_workouts(*WORKOUT_PDF_FIELDS)
+    ))
     
     if not plan:
         raise HTTPException(status_code=404, detail="Plan not found")
         
-    profile = db.query(UserProfile).filter(UserProfile.user_id == user.id).first()
-
-    pdf_bytes = generate_weekly_pdf(plan, profile)
+    cached = await pdf_render.cached_pdf(pdf_cache.weekly_inputs(plan, user.profile, user))
     
     filename = f"Ironclad_Week_{plan.start_date}.pdf"
-    
-    return Response(
-        content=pdf_bytes,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    return pdf_response(cached, filename, if_none_match)
 
 
-@app.get("/plans/{plan_id}/export/nutrition-pdf")
-def export_nutrition_pdf(
+@app.get("/plans/{plan_id}/export/nutrition-pdf", dependencies=[Depends(use_replica)])
+async def export_nutrition_pdf(
     plan_id: int,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
 ):
     
-    plan = db.query(TrainingPlan).filter(
-        TrainingPlan.id == plan_id,
-        TrainingPlan.user_id == user.id
-    ).first()
+    plan = await fetch_plan(db, user_plan_stmt(
+        user.id, plan_id, load_plan_workouts(*WORKOUT_NUTRITION_FIELDS)
+    ))
     
     if not plan:
         raise HTTPException(status_code=404, detail="Plan not found")
         
-    profile = db.query(UserProfile).filter(UserProfile.user_id == user.id).first()
-
-    
-    calc = NutritionCalculator(user_profile=profile, user=user)
-    nutrition_data = []
-    
-    sorted_workouts = sorted(plan.workouts, key=lambda x: x.date)
-    for workout in sorted_workouts:
-        daily_data = calc.calculate_daily_needs(workout)
-        nutrition_data.append(daily_data)
+    nutrition_data = [nutrition.needs_for(user.profile, user, workout) for workout in plan.workouts]
 
-    
-    pdf_bytes = generate_nutrition_pdf(plan, profile, nutrition_data)
+    cached = await pdf_render.cached_pdf(
+        pdf_cache.nutrition_inputs(plan, user.profile, user, nutrition_data)
+    )
     
     filename = f"Nutrition_Week_{plan.start_date}.pdf"
-    
-    return Response(
-        content=pdf_bytes,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
\ No newline at end of file
+    return pdf_response(cached, filename, if_none_match)
+
+
+# Upper bound on weeks per archive request; larger exports should be split.
+ARCHIVE_MAX_PLANS = int(os.getenv("ARCHIVE_MAX_PLANS", "52"))
+
+
+@app.get("/plans/export/archive", dependencies=[Depends(use_replica)])
+async def export_plan_archive(
+    plan_id: Optional[List[int]] = Query(None),
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Every selected week as one ZIP: training PDF, nutrition PDF and a ZWO
+    file per endurance session.
+    Select weeks by repeated ?plan_id= or by a start_date/end_date range
+    (plans overlapping it). Renders run in parallel on the PDF pool; the
+    archive is streamed member by member, with an ERRORS.txt listing any
+    that failed once streaming had begun.
+    """
+    if not plan_id and not (start_date and end_date):
+        raise HTTPException(status_code=400, detail="Pass plan_id values or both start_date and end_date")
+
+    stmt = (
+        select(TrainingPlan)
+        .options(load_plan_workouts(*WORKOUT_PDF_FIELDS, DailyWorkout.modality))
+        .where(TrainingPlan.user_id == user.id)
+        .order_by(TrainingPlan.start_date, TrainingPlan.id)
+        .limit(ARCHIVE_MAX_PLANS + 1)
+    )
+    if plan_id:
+        stmt = stmt.where(TrainingPlan.id.in_(plan_id))
+    if start_date and end_date:
+        stmt = stmt.where(TrainingPlan.start_date <= end_date, TrainingPlan.end_date >= start_date)
+
+    plans = (await db.scalars(stmt)).unique().all()
+    if not plans:
+        raise HTTPException(status_code=404, detail="No plans found")
+    if len(plans) > ARCHIVE_MAX_PLANS:
+        raise HTTPException(status_code=400, detail=f"At most {ARCHIVE_MAX_PLANS} plans per archive")
+
+    # Snapshot everything now: the session is closed before the body streams.
+    ftp = workout_files.profile_ftp(user.profile)
+    members = []
+    for plan in plans:
+        folder = f"{plan.start_date}_plan{plan.id}"
+        weekly = pdf_cache.weekly_inputs(plan, user.profile, user)
+        nutrition_week = pdf_cache.nutrition_inputs(
+            plan, user.profile, user,
+            [nutrition.needs_for(user.profile, user, workout) for workout in plan.workouts],
+        )
+        members.append(zip_stream.Member(
+            f"{folder}/Ironclad_Week_{plan.start_date}.pdf",
+            lambda inputs=weekly: pdf_render.pdf_document(inputs),
+            compress=False,
+        ))
+        members.append(zip_stream.Member(
+            f"{folder}/Nutrition_Week_{plan.start_date}.pdf",
+            lambda inputs=nutrition_week: pdf_render.pdf_document(inputs),
+            compress=False,
+        ))
+        for workout in plan.workouts:
+            if workout_files.supports(workout):
+                content = workout_files.compile_workout(workout, "zwo", ftp).encode()
+                members.append(zip_stream.Member(
+                    f"{folder}/zwo/{workout_files.filename(workout, 'zwo')}",
+                    lambda content=content: zip_stream.ready(content),
+                ))
+
+    metrics.histogram("export.archive.plans").observe(len(plans))
+    filename = f"Ironclad_{plans[0].start_date}_to_{plans[-1].end_date}.zip"
+    # The first member is awaited here so a failing render pool still gets
+    # its 503; later failures end up in the archive's ERRORS.txt.
+    body = await zip_stream.started(zip_stream.stream_zip(members, window=pdf_render.PDF_RENDER_WORKERS * 2))
+    return StreamingResponse(
+        body,
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
@@ -0,0 +1,161 @@
+"""
+Schema maintenance CLI. The app no longer creates tables on import; run
+this once per deploy before starting workers.
+
+    python migrate.py create      create missing tables and columns, then build indexes
+    python migrate.py columns     add missing nullable columns, drop retired ones
+    python migrate.py indexes     build missing indexes/unique constraints online
+
+On PostgreSQL indexes are built with CREATE INDEX CONCURRENTLY so reads and
+writes keep flowing; unique constraints are then attached to the finished
+index with ADD CONSTRAINT ... USING INDEX, which only needs a brief lock.
+Other dialects (SQLite in dev) get plain CREATE INDEX IF NOT EXISTS.
+"""
+import argparse
+
+from sqlalchemy import UniqueConstraint, inspect, text
+
+import models  # noqa: F401  (registers tables on Base.metadata)
+from db import Base, engine
+
+
+# Rows that would violate a new unique key. Keeps the most recent row per key.
+DEDUPE_BEFORE_UNIQUE = {
+    "uq_daily_nutrition_logs_user_id_date": "daily_nutrition_logs",
+    "uq_daily_sleep_logs_user_id_date": "daily_sleep_logs",
+}
+
+
+# Columns removed from the models whose data is no longer needed.
+RETIRED_COLUMNS = {
+    "daily_workouts": ["zwo_content"],  # trainer files are compiled on demand
+}
+
+
+def _targets():
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if len(index.columns) > 1:
+                yield table, index.name, [c.name for c in index.columns], index.unique, False
+        for constraint in table.constraints:
+            if isinstance(constraint, UniqueConstraint) and constraint.name:
+                yield table, constraint.name, [c.name for c in constraint.columns], True, True
+
+
+def _dedupe(conn, table_name: str, columns):
+    match = " AND ".join(f"a.{c} = b.{c}" for c in columns)
+    result = conn.execute(text(
+        f"DELETE FROM {table_name} a USING {table_name} b "
+        f"WHERE {match} AND a.id < b.id"
+    ))
+    if result.rowcount:
+        print(f"  removed {result.rowcount} duplicate rows from {table_name}")
+
+
+def _pg_index_valid(conn, name: str):
+    return conn.execute(text(
+        "SELECT i.indisvalid FROM pg_index i "
+        "JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+    ), {"name": name}).scalar()
+
+
+def _pg_has_constraint(conn, name: str) -> bool:
+    return conn.execute(text(
+        "SELECT 1 FROM pg_constraint WHERE conname = :name"
+    ), {"name": name}).scalar() is not None
+
+
+def _build_postgres(conn, table, name, columns, unique, is_constraint):
+    if is_constraint and _pg_has_constraint(conn, name):
+        return
+
+    # A cancelled CONCURRENTLY build leaves an INVALID index behind.
+    if _pg_index_valid(conn, name) is False:
+        print(f"  dropping invalid index {name}")
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+    if unique and name in DEDUPE_BEFORE_UNIQUE:
+        _dedupe(conn, table.name, columns)
+
+    cols = ", ".join(columns)
+    print(f"  building {name} on {table.name} ({cols})")
+    conn.execute(text(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY IF NOT EXISTS "
+        f"{name} ON {table.name} ({cols})"
+    ))
+
+    if is_constraint:
+        conn.execute(text(
+            f"ALTER TABLE {table.name} ADD CONSTRAINT {name} UNIQUE USING INDEX {name}"
+        ))
+
+
+def _build_generic(conn, table, name, columns, unique, is_constraint):
+    cols = ", ".join(columns)
+    print(f"  building {name} on {table.name} ({cols})")
+    conn.execute(text(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table.name} ({cols})"
+    ))
+
+
+def add_columns():
+    """
+    Adds model columns missing from existing tables and drops RETIRED_COLUMNS.
+    Only nullable columns without server defaults are added, which PostgreSQL
+    does without rewriting the table.
+    """
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        existing = set(inspector.get_table_names())
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing:
+                continue
+            present = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in present:
+                    continue
+                if not column.nullable or column.server_default is not None:
+                    raise RuntimeError(f"{table.name}.{column.name} needs a hand-written migration.")
+                col_type = column.type.compile(dialect=conn.dialect)
+                print(f"  adding column {table.name}.{column.name} ({col_type})")
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+
+        for table_name, columns in RETIRED_COLUMNS.items():
+            if table_name not in existing:
+                continue
+            present = {c["name"] for c in inspector.get_columns(table_name)}
+            for column in columns:
+                if column in present:
+                    print(f"  dropping column {table_name}.{column}")
+                    conn.execute(text(f"ALTER TABLE {table_name} DROP COLUMN {column}"))
+
+
+def build_indexes():
+    build = _build_postgres if engine.dialect.name == "postgresql" else _build_generic
+
+    # CONCURRENTLY cannot run inside a transaction block.
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        existing = set(inspect(conn).get_table_names())
+        for target in _targets():
+            # Missing tables get their indexes from create_all instead.
+            if target[0].name in existing:
+                build(conn, *target)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ironclad schema maintenance")
+    parser.add_argument("command", choices=["create", "columns", "indexes"])
+    args = parser.parse_args()
+
+    if args.command == "create":
+        Base.metadata.create_all(bind=engine)
+        add_columns()
+        build_indexes()
+    elif args.command == "columns":
+        add_columns()
+    elif args.command == "indexes":
+        build_indexes()
+
+
+if __name__ == "__main__":
+    main()
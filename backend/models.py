@@ -1,8 +1,22 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Date, Float, DateTime, Text, JSON
-from sqlalchemy.orm import relationship
+import os
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Date, Float, DateTime, Text, JSON, Index, UniqueConstraint, and_
+from sqlalchemy.orm import relationship, deferred, column_property, selectinload, joinedload, subqueryload
 from datetime import datetime
 from db import Base
 
+
+# Eager strategy used when a route loads TrainingPlan.workouts.
+PLAN_WORKOUTS_LOADER = os.getenv("PLAN_WORKOUTS_LOADER", "selectin")
+
+_LOADERS = {
+    "selectin": selectinload,
+    "joined": joinedload,
+    "subquery": subqueryload,
+}
+
+if PLAN_WORKOUTS_LOADER not in _LOADERS:
+    raise RuntimeError(f"PLAN_WORKOUTS_LOADER must be one of {sorted(_LOADERS)}.")
+
 class User(Base):
     __tablename__ = "users"
 
@@ -65,6 +79,9 @@ class UserProfile(Base):
 
 class TrainingPlan(Base):
     __tablename__ = "training_plans"
+    __table_args__ = (
+        Index("ix_training_plans_user_id_created_at", "user_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -81,11 +98,19 @@ class TrainingPlan(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="plans")
-    workouts = relationship("DailyWorkout", back_populates="plan", cascade="all, delete-orphan")
+    workouts = relationship(
+        "DailyWorkout",
+        back_populates="plan",
+        cascade="all, delete-orphan",
+        order_by="DailyWorkout.date",
+    )
 
 
 class DailyWorkout(Base):
     __tablename__ = "daily_workouts"
+    __table_args__ = (
+        Index("ix_daily_workouts_plan_id_date", "plan_id", "date"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     plan_id = Column(Integer, ForeignKey("training_plans.id"))
@@ -100,8 +125,18 @@ class DailyWorkout(Base):
     modality = Column(String, nullable=True)
     estimated_duration_min = Column(Integer)
     
-    structure_json = Column(JSON)
-    zwo_content = Column(Text, nullable=True)
+    # Heavy payloads stay out of the default SELECT; routes undefer them.
+    structure_json = deferred(Column(JSON))
+
+    # Nutrition targets computed when the plan is generated (and recomputed
+    # when bodyweight/height/goal change); see services/nutrition.py.
+    intensity_label = Column(String, nullable=True)
+    target_calories = Column(Integer, nullable=True)
+    target_protein = Column(Integer, nullable=True)
+    target_carbs = Column(Integer, nullable=True)
+    target_fats = Column(Integer, nullable=True)
+    target_hydration_liters = Column(Float, nullable=True)
+    nutrition_timing = Column(JSON, nullable=True)
     
     
     completed = Column(Boolean, default=False)
@@ -111,14 +146,25 @@ class DailyWorkout(Base):
     notes = Column(Text, nullable=True)
 
     plan = relationship("TrainingPlan", back_populates="workouts")
-    zwo_content = Column(Text, nullable=True)
 
-    @property
-    def has_zwo(self):
-        return bool(self.zwo_content)
+
+# Trainer files are compiled on demand (services/workout_files.py) for every
+# endurance session; mirrors workout_files.supports().
+DailyWorkout.has_zwo = column_property(
+    and_(DailyWorkout.__table__.c.workout_type == "Endurance", DailyWorkout.__table__.c.is_rest_day.isnot(True))
+)
+
+
+def load_plan_workouts(*columns):
+    """Loader option for TrainingPlan.workouts, optionally limited to `columns`."""
+    loader = _LOADERS[PLAN_WORKOUTS_LOADER](TrainingPlan.workouts)
+    return loader.load_only(*columns) if columns else loader
 
 class DailyNutritionLog(Base):
     __tablename__ = "daily_nutrition_logs"
+    __table_args__ = (
+        UniqueConstraint("user_id", "date", name="uq_daily_nutrition_logs_user_id_date"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -138,6 +184,9 @@ class DailyNutritionLog(Base):
 
 class DailySleepLog(Base):
     __tablename__ = "daily_sleep_logs"
+    __table_args__ = (
+        UniqueConstraint("user_id", "date", name="uq_daily_sleep_logs_user_id_date"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -153,3 +202,47 @@ class DailySleepLog(Base):
     notes = Column(Text, nullable=True)
     
     user = relationship("User", back_populates="sleep_logs")
+
+
+class ResourceVersion(Base):
+    """Per-user change counter for a cacheable resource (see versions.py)."""
+    __tablename__ = "resource_versions"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    resource = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class ChatConversation(Base):
+    """Server-side chat history (see chat_sessions.py). Turns that no longer
+    fit the prompt budget are folded into `summary` and deleted."""
+    __tablename__ = "chat_conversations"
+
+    id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    summary = Column(Text, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    messages = relationship(
+        "ChatMessage",
+        back_populates="conversation",
+        order_by="ChatMessage.id",
+        cascade="all, delete-orphan",
+    )
+
+
+class ChatMessage(Base):
+    __tablename__ = "chat_messages"
+    __table_args__ = (
+        Index("ix_chat_messages_conversation_id_id", "conversation_id", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    conversation_id = Column(String, ForeignKey("chat_conversations.id"), nullable=False)
+    role = Column(String, nullable=False)
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    conversation = relationship("ChatConversation", back_populates="messages")
@@ -0,0 +1,259 @@
+"""
+Cache for rendered PDF exports, keyed on a hash of everything the renderer
+reads (plan, workouts, profile fields, nutrition targets). Unchanged inputs
+are served from the store; any change produces a new key, so nothing needs
+invalidating and stale entries simply age out of the LRU.
+
+PDF_CACHE_BACKEND picks the store: "disk" (default, shared by every worker
+pointed at the same PDF_CACHE_DIR) or "memory" (per process).
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, NamedTuple
+
+from cache import TTLCache
+
+try:
+    import fcntl
+except ImportError:  # Windows: evictions from different workers aren't serialized
+    fcntl = None
+
+PDF_CACHE_BACKEND = os.getenv("PDF_CACHE_BACKEND", "disk").lower()
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "ironclad-pdf-cache")
+PDF_CACHE_MAX_BYTES = int(float(os.getenv("PDF_CACHE_MAX_MB", "256")) * 1024 * 1024)
+PDF_CACHE_ETAGS = int(os.getenv("PDF_CACHE_ETAGS", "4096"))
+
+# Bump when PDFGenerator's layout changes so old renders stop matching.
+RENDER_VERSION = 1
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+class CachedPDF(NamedTuple):
+    etag: str
+    size: int
+    chunks: Iterator[bytes]
+
+
+def etag(pdf_bytes: bytes) -> str:
+    # Hash of the bytes actually served: fpdf stamps a creation time into the
+    # document, so a re-render of the same inputs is a different entity.
+    return '"' + hashlib.sha256(pdf_bytes).hexdigest()[:32] + '"'
+
+
+def _slices(data: bytes):
+    for offset in range(0, len(data), CHUNK_SIZE):
+        yield data[offset:offset + CHUNK_SIZE]
+
+
+class _FileChunks:
+    """
+    Iterates an open file in CHUNK_SIZE pieces and closes it when exhausted.
+    Unlike a generator it can also be closed before iteration starts, which
+    is what a 304 does with it.
+    """
+
+    def __init__(self, f):
+        self._f = f
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk = self._f.read(CHUNK_SIZE)
+        if not chunk:
+            self.close()
+            raise StopIteration
+        return chunk
+
+    def close(self):
+        self._f.close()
+
+
+class MemoryStore:
+    """Byte-bounded LRU of rendered documents in this process."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()  # key -> (etag, bytes)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            self._data.move_to_end(key)
+        tag, data = entry
+        return CachedPDF(tag, len(data), _slices(data))
+
+    def put(self, key: str, data: bytes):
+        with self._lock:
+            previous = self._data.pop(key, None)
+            self._size -= len(previous[1]) if previous else 0
+            self._data[key] = (etag(data), data)
+            self._size += len(data)
+            while self._size > self.max_bytes and len(self._data) > 1:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self._size -= len(evicted)
+
+
+class DiskStore:
+    """
+    One file per key under `directory`, shared by every worker pointed at it.
+    The directory is the index: a hit stamps the file's access time, and
+    after each write the writer scans the directory and removes the least
+    recently used files until the total is back under max_bytes, so the
+    bound holds across workers. Writes only follow renders, which cost far
+    more than the scan. Files are written atomically, so workers never read a
+    partial document; hits stream from an open handle, which survives a
+    concurrent eviction.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # key -> ((inode, size, mtime), etag), so each process hashes a given
+        # file once. Hits only touch atime, which keeps mtime a write stamp.
+        self._etags = TTLCache(maxsize=PDF_CACHE_ETAGS, ttl=3600)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def get(self, key: str):
+        try:
+            f = open(self._path(key), "rb")
+        except FileNotFoundError:
+            return None
+        stat = os.fstat(f.fileno())
+        try:
+            os.utime(self._path(key), ns=(time.time_ns(), stat.st_mtime_ns))
+        except FileNotFoundError:
+            pass  # evicted since it was opened; the handle still reads it
+
+        identity = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        known = self._etags.get(key)
+        if known is not None and known[0] == identity:
+            tag = known[1]
+        else:
+            # Written by another worker, or before a restart.
+            tag = etag(f.read())
+            f.seek(0)
+            self._etags.set(key, (identity, tag))
+        return CachedPDF(tag, stat.st_size, _FileChunks(f))
+
+    def put(self, key: str, data: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        stat = os.stat(tmp_path)
+        os.replace(tmp_path, self._path(key))
+        self._etags.set(key, ((stat.st_ino, stat.st_size, stat.st_mtime_ns), etag(data)))
+        self._evict(keep=f"{key}.pdf")
+
+    @contextmanager
+    def _eviction_lock(self):
+        # Two workers evicting at once would each delete for the same excess.
+        with self._lock, open(os.path.join(self.directory, ".evict.lock"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _evict(self, keep: str):
+        with self._eviction_lock():
+            files = []
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(".pdf"):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_atime_ns, entry.name, stat.st_size))
+
+            total = sum(size for _, _, size in files)
+            for _, name, size in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                if name == keep:
+                    continue
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+def _create_store():
+    if PDF_CACHE_BACKEND == "disk":
+        return DiskStore(PDF_CACHE_DIR, PDF_CACHE_MAX_BYTES)
+    if PDF_CACHE_BACKEND == "memory":
+        return MemoryStore(PDF_CACHE_MAX_BYTES)
+    raise RuntimeError(f"PDF_CACHE_BACKEND must be 'disk' or 'memory', got {PDF_CACHE_BACKEND!r}.")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    # Created on first export so importing the app never touches the disk.
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = _create_store()
+        return _store
+
+
+def _athlete(user_profile, user) -> dict:
+    return {
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "goal": user_profile.goal,
+    }
+
+
+def weekly_inputs(plan, user_profile, user) -> dict:
+    """Plain-data snapshot generate_weekly_pdf renders from; also what the cache key hashes."""
+    return {
+        "kind": "weekly",
+        "start_date": plan.start_date,
+        "athlete": _athlete(user_profile, user),
+        "workouts": [
+            {
+                "date": w.date,
+                "title": w.title,
+                "is_rest_day": w.is_rest_day,
+                "workout_type": w.workout_type,
+                "estimated_duration_min": w.estimated_duration_min,
+                "structure_json": w.structure_json,
+            }
+            for w in plan.workouts
+        ],
+    }
+
+
+def nutrition_inputs(plan, user_profile, user, nutrition_data) -> dict:
+    """Plain-data snapshot generate_nutrition_pdf renders from; also what the cache key hashes."""
+    return {
+        "kind": "nutrition",
+        "start_date": plan.start_date,
+        "athlete": _athlete(user_profile, user),
+        "days": nutrition_data,
+    }
+
+
+def cache_key(inputs: dict) -> str:
+    payload = json.dumps([RENDER_VERSION, inputs], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
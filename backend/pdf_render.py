@@ -0,0 +1,157 @@
+"""
+PDF exports rendered off the event loop and off the API workers' threadpool.
+
+fpdf is pure Python and holds the GIL for the whole render, so renders run
+in a small process pool fed plain-data snapshots (see pdf_cache), never ORM
+objects. Finished documents go into the PDF cache and are streamed back
+from there in chunks.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+import pdf_cache
+
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", str(min(2, os.cpu_count() or 1))))
+PDF_RENDER_QUEUE_DEPTH = int(os.getenv("PDF_RENDER_QUEUE_DEPTH", "16"))
+
+RENDERERS = {
+    "weekly": "generate_weekly_pdf",
+    "nutrition": "generate_nutrition_pdf",
+}
+
+
+def _render(kind: str, inputs: dict, submitted_at: float):
+    """Runs in a pool process. Wall-clock stamps, since perf_counter isn't
+    comparable across processes."""
+    started_at = time.time()
+    from services import PDFGenerator
+
+    pdf_bytes = getattr(PDFGenerator, RENDERERS[kind])(inputs)
+    return pdf_bytes, started_at - submitted_at, time.time() - started_at
+
+
+class PDFRenderPool:
+    """
+    Bounded process pool for renders. Like the password hash pool, admission
+    is capped at workers + queue_depth and anything beyond gets a 503, so an
+    export burst can't queue unbounded work or memory.
+    """
+
+    def __init__(self, workers: int, queue_depth: int):
+        self._workers = workers
+        self._executor = None
+        self._limit = workers + queue_depth
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Spawned lazily (and with "spawn", not fork) so importing the app
+        # stays cheap and children don't inherit the parent's DB pools.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self._workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    async def render(self, kind: str, inputs: dict) -> bytes:
+        with self._lock:
+            if self._pending >= self._limit:
+                metrics.counter("pdf_render.rejected").inc()
+                raise HTTPException(
+                    status_code=503,
+                    detail="PDF export is busy, please retry",
+                    headers={"Retry-After": "2"},
+                )
+            self._pending += 1
+            metrics.gauge("pdf_render.pending").set(self._pending)
+
+        executor = None
+        try:
+            executor = self._get_executor()
+            pdf_bytes, queued_s, render_s = await asyncio.get_running_loop().run_in_executor(
+                executor, _render, kind, inputs, time.time()
+            )
+        except BrokenProcessPool:
+            # A worker died (OOM, crash in fpdf) and took the pool with it.
+            # Drop it so the next export spawns a fresh one.
+            metrics.counter("pdf_render.broken_pool").inc()
+            self._discard(executor)
+            raise HTTPException(
+                status_code=503,
+                detail="PDF export is restarting, please retry",
+                headers={"Retry-After": "2"},
+            )
+        finally:
+            with self._lock:
+                self._pending -= 1
+                metrics.gauge("pdf_render.pending").set(self._pending)
+
+        metrics.histogram("pdf_render.queue_wait_ms").observe(max(0.0, queued_s) * 1000)
+        metrics.histogram(f"pdf_render.{kind}.render_ms").observe(render_s * 1000)
+        metrics.histogram(f"pdf_render.{kind}.bytes").observe(len(pdf_bytes))
+        return pdf_bytes
+
+    def _discard(self, executor):
+        with self._lock:
+            # Only if nobody has replaced it already.
+            if self._executor is executor:
+                self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+render_pool = PDFRenderPool(PDF_RENDER_WORKERS, PDF_RENDER_QUEUE_DEPTH)
+
+
+async def cached_pdf(inputs: dict) -> pdf_cache.CachedPDF:
+    """The cached export for `inputs`, rendering it in the pool on a miss."""
+    kind = inputs["kind"]
+    store = pdf_cache.get_store()
+    key = pdf_cache.cache_key(inputs)
+
+    cached = await run_in_threadpool(store.get, key)
+    if cached is not None:
+        metrics.counter(f"pdf_cache.{kind}.hits").inc()
+        return cached
+
+    metrics.counter(f"pdf_cache.{kind}.misses").inc()
+    pdf_bytes = await render_pool.render(kind, inputs)
+    await run_in_threadpool(store.put, key, pdf_bytes)
+    cached = await run_in_threadpool(store.get, key)
+    if cached is None:
+        # Evicted between put and get by a burst of larger exports.
+        return pdf_cache.CachedPDF(pdf_cache.etag(pdf_bytes), len(pdf_bytes), iter([pdf_bytes]))
+    return cached
+
+
+async def pdf_document(inputs: dict, attempts: int = 20) -> bytes:
+    """
+    The whole document for `inputs`, for callers that can't fail halfway
+    (archive exports): pool rejections are waited out instead of raised.
+    """
+    for attempt in range(attempts):
+        try:
+            cached = await cached_pdf(inputs)
+            break
+        except HTTPException as e:
+            if e.status_code != 503 or attempt == attempts - 1:
+                raise
+            await asyncio.sleep(0.5)
+    return await run_in_threadpool(b"".join, cached.chunks)
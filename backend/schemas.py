@@ -1,5 +1,5 @@
 
-from pydantic import BaseModel, EmailStr, validator
+from pydantic import BaseModel, EmailStr, Field, validator
 from datetime import date, datetime
 from typing import Optional, Dict, Any, List
 
@@ -64,6 +64,7 @@ class ProfileCreate(BaseModel):
 
 class GeneratePlanRequest(BaseModel):
     start_date: date
+    weeks: int = Field(default=1, ge=1, le=52)
 
 class WorkoutStep(BaseModel):
     """Represents a single step in a workout (e.g., 'Main Work' or 'Interval')"""
@@ -114,6 +115,9 @@ class LogNutrition(BaseModel):
 
 class ChatRequest(BaseModel):
     message: str
+    # Returned by the first reply; omit to start a new conversation.
+    conversation_id: Optional[str] = None
+    # Deprecated: only used to seed a new conversation for older clients.
     history: list = []
 
 class CompleteWorkoutRequest(BaseModel):
@@ -1,51 +1,124 @@
-from google import genai
-from google.genai import types
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
 
 load_dotenv()
 api_key1 = os.getenv("GOOGLE_API_KEY")
 
-if not api_key1:
-    raise RuntimeError("GOOGLE_API_KEY is not set.")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite")
+# Point at fake_llm.py (or any Gemini-compatible endpoint) for local testing.
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
 
-client = genai.Client(api_key=api_key1) 
 
-def chat_with_gemini(system_instruction: str, chat_history: list):
+@lru_cache(maxsize=1)
+def get_client():
+    # google.genai is slow to import; only pay for it on the first chat.
+    from google import genai
+    from google.genai import types
+
+    if not api_key1:
+        raise RuntimeError("GOOGLE_API_KEY is not set.")
+    http_options = types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None
+    return genai.Client(api_key=api_key1, http_options=http_options)
+
+
+def _tool_content(msg):
+    """Tool-loop turns: the model's function calls (replayed verbatim when we
+    have them) and our function responses."""
+    from google.genai import types
+
+    if msg["role"] == "tool":
+        return types.Content(
+            role="user",
+            parts=[types.Part.from_function_response(name=msg["name"], response={"result": msg["result"]})]
+        )
+    if msg.get("raw") is not None:
+        return msg["raw"]
+    return types.Content(
+        role="model",
+        parts=[types.Part.from_function_call(name=c["name"], args=c.get("args") or {}) for c in msg["tool_calls"]]
+    )
+
+
+def _request(system_instruction: str, chat_history: list, tools=None) -> dict:
+    from google.genai import types
+
+    formatted_contents = []
     
-    try:
-        
-        formatted_contents = []
-        
-        
-        
+    
+    
+    formatted_contents.append(
+        types.Content(
+            role="user",
+            parts=[types.Part.from_text(text=system_instruction)]
+        )
+    )
+    
+    
+    for msg in chat_history:
+        if msg["role"] == "tool" or "tool_calls" in msg:
+            formatted_contents.append(_tool_content(msg))
+            continue
+        role = "user" if msg["role"] == "user" else "model"
         formatted_contents.append(
             types.Content(
-                role="user",
-                parts=[types.Part.from_text(text=system_instruction)]
+                role=role,
+                parts=[types.Part.from_text(text=msg["content"])]
             )
         )
-        
-        
-        for msg in chat_history:
-            role = "user" if msg["role"] == "user" else "model"
-            formatted_contents.append(
-                types.Content(
-                    role=role,
-                    parts=[types.Part.from_text(text=msg["content"])]
-                )
-            )
 
-        
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-lite", 
-            contents=formatted_contents,
-            config=types.GenerateContentConfig(
-                temperature=0.7, 
-                max_output_tokens=500 
-            )
+    return dict(
+        model=GEMINI_MODEL,
+        contents=formatted_contents,
+        config=types.GenerateContentConfig(
+            temperature=0.7, 
+            max_output_tokens=500,
+            tools=[types.Tool(function_declarations=[
+                types.FunctionDeclaration(name=t["name"], description=t["description"]) for t in tools
+            ])] if tools else None,
         )
-        return response.text
-    except Exception as e:
-        print(f"Gemini Error: {e}")
-        return "Command Link Severed. Unable to process request."
\ No newline at end of file
+    )
+
+
+async def stream_gemini(system_instruction: str, chat_history: list):
+    """
+    Yields (text, prompt_tokens, output_tokens) per chunk from the async
+    client; token counts are None until Gemini reports usage. Deadlines and
+    limits are the gateway's job (services/llm_gateway.py). Closing the
+    generator closes the upstream stream, so an abandoned answer stops
+    generating.
+    """
+    stream = await get_client().aio.models.generate_content_stream(
+        **_request(system_instruction, chat_history)
+    )
+    try:
+        async for chunk in stream:
+            usage = chunk.usage_metadata
+            yield (
+                chunk.text or "",
+                usage.prompt_token_count if usage else None,
+                usage.candidates_token_count if usage else None,
+            )
+    finally:
+        await stream.aclose()
+
+
+async def generate_with_tools(system_instruction: str, chat_history: list, tools: list):
+    """
+    One round of the tool loop: (text, tool_calls, prompt_tokens,
+    output_tokens). tool_calls is a model turn to append to the history when
+    Gemini asks for functions, else None.
+    """
+    response = await get_client().aio.models.generate_content(
+        **_request(system_instruction, chat_history, tools)
+    )
+    usage = response.usage_metadata
+    counts = (usage.prompt_token_count, usage.candidates_token_count) if usage else (None, None)
+    if response.function_calls:
+        turn = {
+            "role": "model",
+            "tool_calls": [{"name": c.name, "args": c.args or {}} for c in response.function_calls],
+            "raw": response.candidates[0].content,
+        }
+        return ("", turn, *counts)
+    return (response.text or "", None, *counts)
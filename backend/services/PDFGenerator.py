@@ -12,49 +12,50 @@ class PlanPDF(FPDF):
         self.set_font('Arial', 'I', 8)
         self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
 
-def generate_weekly_pdf(plan, user_profile):
+def generate_weekly_pdf(week):
+    """Renders a pdf_cache.weekly_inputs snapshot. Plain data only, so it can
+    run in a worker process."""
     pdf = PlanPDF()
     pdf.add_page()
     pdf.set_auto_page_break(auto=True, margin=15)
 
     
     pdf.set_font("Arial", "B", 12)
-    pdf.cell(0, 10, f"Week of: {plan.start_date}", 0, 1, 'L')
+    athlete = week['athlete']
+    pdf.cell(0, 10, f"Week of: {week['start_date']}", 0, 1, 'L')
     pdf.set_font("Arial", "", 10)
-    pdf.cell(0, 5, f"Athlete: {user_profile.user.first_name} {user_profile.user.last_name}", 0, 1, 'L')
-    pdf.cell(0, 5, f"Goal: {user_profile.goal}", 0, 1, 'L')
+    pdf.cell(0, 5, f"Athlete: {athlete['first_name']} {athlete['last_name']}", 0, 1, 'L')
+    pdf.cell(0, 5, f"Goal: {athlete['goal']}", 0, 1, 'L')
     pdf.ln(10)
 
   
-    sorted_workouts = sorted(plan.workouts, key=lambda x: x.date)
-
-    for workout in sorted_workouts:
+    for workout in week['workouts']:
         
         pdf.set_fill_color(240, 240, 240)
         pdf.set_font("Arial", "B", 11)
-        day_str = workout.date.strftime("%A, %b %d")
-        pdf.cell(0, 8, f"{day_str} - {workout.title}", 0, 1, 'L', fill=True)
+        day_str = workout['date'].strftime("%A, %b %d")
+        pdf.cell(0, 8, f"{day_str} - {workout['title']}", 0, 1, 'L', fill=True)
         
         
         pdf.set_font("Arial", "", 10)
         
-        if workout.is_rest_day:
+        if workout['is_rest_day']:
             pdf.ln(2)
             pdf.cell(0, 5, "Focus: Active Recovery", 0, 1)
             pdf.cell(0, 5, "Notes: Sleep 8h+, Hydrate, Mobility work.", 0, 1)
         else:
             pdf.ln(2)
-            pdf.cell(0, 5, f"Type: {workout.workout_type}", 0, 1)
-            pdf.cell(0, 5, f"Duration: {workout.estimated_duration_min} min", 0, 1)
+            pdf.cell(0, 5, f"Type: {workout['workout_type']}", 0, 1)
+            pdf.cell(0, 5, f"Duration: {workout['estimated_duration_min']} min", 0, 1)
             
             
-            if workout.structure_json:
+            if workout['structure_json']:
                 pdf.ln(2)
                 pdf.set_font("Arial", "B", 9)
                 pdf.cell(0, 5, "SESSION STRUCTURE:", 0, 1)
                 pdf.set_font("Arial", "", 9)
                 
-                for step in workout.structure_json:
+                for step in workout['structure_json']:
                     
                     name = step.get('type', 'Effort').capitalize()
                     duration = step.get('duration', '-')
@@ -70,22 +71,24 @@ def generate_weekly_pdf(plan, user_profile):
 
     return pdf.output(dest='S').encode('latin-1')
 
-def generate_nutrition_pdf(plan, user_profile, nutrition_data):
+def generate_nutrition_pdf(week):
+    """Renders a pdf_cache.nutrition_inputs snapshot."""
     pdf = PlanPDF()
     pdf.add_page()
     pdf.set_auto_page_break(auto=True, margin=15)
 
     
     pdf.set_font("Arial", "B", 12)
-    pdf.cell(0, 10, f"NUTRITION PROTOCOL: Week of {plan.start_date}", 0, 1, 'L')
+    athlete = week['athlete']
+    pdf.cell(0, 10, f"NUTRITION PROTOCOL: Week of {week['start_date']}", 0, 1, 'L')
     pdf.set_font("Arial", "", 10)
-    pdf.cell(0, 5, f"Athlete: {user_profile.user.first_name} {user_profile.user.last_name}", 0, 1, 'L')
-    pdf.cell(0, 5, f"Goal: {user_profile.goal}", 0, 1, 'L')
+    pdf.cell(0, 5, f"Athlete: {athlete['first_name']} {athlete['last_name']}", 0, 1, 'L')
+    pdf.cell(0, 5, f"Goal: {athlete['goal']}", 0, 1, 'L')
     pdf.ln(10)
 
     
     
-    for day_data in nutrition_data:
+    for day_data in week['days']:
         ctx = day_data['day_context']
         targets = day_data['targets']
         timing = day_data.get('timing', [])
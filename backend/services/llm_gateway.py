@@ -0,0 +1,361 @@
+"""
+Every chat model call goes through the gateway, which adds what the raw
+client lacks:
+
+- a deadline per call (LLM_TIMEOUT_SECONDS, first byte to last),
+- in-flight limits, global (LLM_MAX_IN_FLIGHT, 503) and per user
+  (LLM_MAX_IN_FLIGHT_PER_USER, 429), so a slow upstream can't tie up
+  every worker,
+- a circuit breaker: after LLM_BREAKER_FAILURES consecutive failures calls
+  fail fast for LLM_BREAKER_COOLDOWN_SECONDS, then a single trial call
+  decides whether to close it again,
+- llm.* latency and token metrics,
+- a response cache: a repeat of the same question against the same
+  context and recent turns is answered without calling the model at all,
+- a tool loop: given tools, the model can ask for lookups (run at most
+  LLM_MAX_TOOL_ROUNDS times) before it answers.
+
+LLM_BACKEND picks the model: "gemini" (default) or "stub", a deterministic
+in-process model for load tests that never touches the network.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import time
+
+from fastapi import HTTPException
+
+import metrics
+from cache import TTLCache
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").lower()
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "32"))
+LLM_MAX_IN_FLIGHT_PER_USER = int(os.getenv("LLM_MAX_IN_FLIGHT_PER_USER", "2"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+
+# Answers keyed on (user, hash of normalized prompt + question + recent
+# turns + the caller's version stamp). Tool-loop answers are built from data
+# the prompt doesn't show, so the stamp (the user's resource versions) is what
+# makes a write on any worker a new key; superseded entries just age out.
+LLM_RESPONSE_CACHE_SIZE = int(os.getenv("LLM_RESPONSE_CACHE_SIZE", "4096"))
+LLM_RESPONSE_CACHE_TTL = float(os.getenv("LLM_RESPONSE_CACHE_TTL", "3600"))
+LLM_CACHE_RECENT_TURNS = int(os.getenv("LLM_CACHE_RECENT_TURNS", "4"))
+
+LLM_MAX_TOOL_ROUNDS = int(os.getenv("LLM_MAX_TOOL_ROUNDS", "3"))
+
+LLM_STUB_TTFT_MS = float(os.getenv("LLM_STUB_TTFT_MS", "200"))
+LLM_STUB_TOKEN_MS = float(os.getenv("LLM_STUB_TOKEN_MS", "10"))
+
+TIMEOUT_DETAIL = "The coach took too long to answer."
+ERROR_DETAIL = "Command Link Severed. Unable to process request."
+
+
+def gemini_backend(system_instruction: str, chat_history: list):
+    from services.GeminiLLM import stream_gemini
+
+    return stream_gemini(system_instruction, chat_history)
+
+
+async def stub_backend(system_instruction: str, chat_history: list):
+    """Same (text, prompt_tokens, output_tokens) chunks as stream_gemini, made up locally."""
+    question = next((m["content"] for m in reversed(chat_history) if m["role"] == "user"), "")
+    words = f"Copy that. You asked: {' '.join(question.split())}. Stay on plan and recover well.".split()
+    prompt_tokens = len(system_instruction.split()) + sum(len(m["content"].split()) for m in chat_history)
+
+    await asyncio.sleep(LLM_STUB_TTFT_MS / 1000)
+    for i, word in enumerate(words):
+        if i:
+            await asyncio.sleep(LLM_STUB_TOKEN_MS / 1000)
+        last = i == len(words) - 1
+        yield (word if i == 0 else " " + word, prompt_tokens if last else None, len(words) if last else None)
+
+
+def gemini_tool_backend(system_instruction: str, chat_history: list, tools: list):
+    from services.GeminiLLM import generate_with_tools
+
+    return generate_with_tools(system_instruction, chat_history, tools)
+
+
+# Which lookups the stub asks for, by words in the question.
+STUB_TOOL_KEYWORDS = {
+    "get_sleep": ("sleep", "tired", "nap", "recover"),
+    "get_today_workout": ("workout", "session", "run", "train", "today"),
+    "get_nutrition_remaining": ("eat", "food", "meal", "macro", "calorie", "protein", "carb", "water"),
+    "get_week_schedule": ("week", "schedule", "plan", "phase"),
+}
+
+
+async def stub_tool_backend(system_instruction: str, chat_history: list, tools: list):
+    """
+    Deterministic stand-in for one tool-loop round: asks for the tools whose
+    keywords appear in the question, then answers from their results.
+    """
+    await asyncio.sleep(LLM_STUB_TTFT_MS / 1000)
+    last_user = max(i for i, m in enumerate(chat_history) if m["role"] == "user")
+    question = " ".join(chat_history[last_user]["content"].split())
+    results = [m for m in chat_history[last_user + 1:] if m["role"] == "tool"]
+    prompt_tokens = len(system_instruction.split()) + len(question.split())
+
+    offered = {t["name"] for t in tools}
+    wanted = [
+        name for name, words in STUB_TOOL_KEYWORDS.items()
+        if name in offered and any(w in question.lower() for w in words)
+    ]
+    if wanted and not results:
+        return "", {"role": "model", "tool_calls": [{"name": name, "args": {}} for name in wanted]}, prompt_tokens, 0
+
+    facts = " ".join(f"[{m['name']}] {m['result']}" for m in results)
+    text = f"Copy that. You asked: {question}. {facts + ' ' if facts else ''}Stay on plan and recover well."
+    return text, None, prompt_tokens, len(text.split())
+
+
+_responses = TTLCache(maxsize=LLM_RESPONSE_CACHE_SIZE, ttl=LLM_RESPONSE_CACHE_TTL)
+
+
+def _normalize(text: str) -> str:
+    # Case, punctuation and spacing don't change the question.
+    return " ".join(re.sub(r"[^\w\s]", " ", (text or "").lower()).split())
+
+
+def response_key(user_id: int, system_instruction: str, chat_history: list, stamp=()):
+    *earlier, question = chat_history
+    recent = earlier[-LLM_CACHE_RECENT_TURNS:] if LLM_CACHE_RECENT_TURNS else []
+    parts = [repr(tuple(stamp)), _normalize(system_instruction), _normalize(question["content"])]
+    parts += [f"{m['role']}:{_normalize(m['content'])}" for m in recent]
+    return user_id, hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+
+BACKENDS = {
+    "gemini": gemini_backend,
+    "stub": stub_backend,
+}
+TOOL_BACKENDS = {
+    "gemini": gemini_tool_backend,
+    "stub": stub_tool_backend,
+}
+
+if LLM_BACKEND not in BACKENDS:
+    raise RuntimeError(f"LLM_BACKEND must be one of {sorted(BACKENDS)}.")
+
+
+class CircuitBreaker:
+    """Closed -> open after `threshold` consecutive failures -> half-open
+    (one trial call) once `cooldown` has passed."""
+
+    CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+
+    def _set(self, state: int):
+        self.state = state
+        metrics.gauge("llm.breaker_state").set(state)
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+            self._set(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            return not self._trial_running
+        return self.state == self.CLOSED
+
+    def started(self):
+        if self.state == self.HALF_OPEN:
+            self._trial_running = True
+
+    def succeeded(self):
+        self._failures = 0
+        self._trial_running = False
+        self._set(self.CLOSED)
+
+    def failed(self):
+        self._failures += 1
+        self._trial_running = False
+        if self.state == self.HALF_OPEN or self._failures >= self.threshold:
+            self._opened_at = time.monotonic()
+            self._set(self.OPEN)
+
+    def abandoned(self):
+        # Client went away mid-call: says nothing about the upstream.
+        self._trial_running = False
+
+
+class LLMGateway:
+    """
+    All state is touched from the event loop only (routes are async), so the
+    counters need no lock.
+    """
+
+    def __init__(self, backend, tool_backend, max_in_flight: int, max_per_user: int, breaker: CircuitBreaker):
+        self.backend = backend
+        self.tool_backend = tool_backend
+        self.max_in_flight = max_in_flight
+        self.max_per_user = max_per_user
+        self.breaker = breaker
+        self._in_flight = 0
+        self._per_user = {}
+
+    def check(self, user_id: int):
+        """
+        Raise the error a call would get right now. Lets /chat/stream answer
+        with a real status code before its response starts; stream() checks
+        again when it actually takes the slot.
+        """
+        if not self.breaker.allow():
+            metrics.counter("llm.circuit_open").inc()
+            raise HTTPException(
+                status_code=503,
+                detail="The coach is unavailable right now, please retry shortly",
+                headers={"Retry-After": str(int(self.breaker.cooldown))},
+            )
+        if self._in_flight >= self.max_in_flight:
+            metrics.counter("llm.rejected").inc()
+            raise HTTPException(
+                status_code=503,
+                detail="The coach is busy, please retry",
+                headers={"Retry-After": "2"},
+            )
+        if self._per_user.get(user_id, 0) >= self.max_per_user:
+            metrics.counter("llm.rejected_user").inc()
+            raise HTTPException(
+                status_code=429,
+                detail="Wait for the current answer before asking again",
+                headers={"Retry-After": "2"},
+            )
+
+    def admit(self, user_id: int, system_instruction: str, chat_history: list, stamp=()):
+        """
+        check(), except that a cached answer is always let through: it
+        never reaches the model, so an open circuit or a full house
+        shouldn't stand in its way.
+        """
+        if _responses.get(response_key(user_id, system_instruction, chat_history, stamp)) is None:
+            self.check(user_id)
+
+    def _acquire(self, user_id: int):
+        self.check(user_id)
+        self.breaker.started()
+        self._in_flight += 1
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        metrics.gauge("llm.in_flight").set(self._in_flight)
+
+    def _release(self, user_id: int):
+        self._in_flight -= 1
+        remaining = self._per_user.pop(user_id) - 1
+        if remaining:
+            self._per_user[user_id] = remaining
+        metrics.gauge("llm.in_flight").set(self._in_flight)
+
+    async def _tool_loop(self, system_instruction: str, chat_history: list, tools):
+        """
+        Same (text, prompt_tokens, output_tokens) shape as a streaming
+        backend, but the answer comes in one piece after the model has had
+        the lookups it asked for. The last round offers no tools, so the
+        model has to answer.
+        """
+        messages = list(chat_history)
+        for round_ in range(LLM_MAX_TOOL_ROUNDS + 1):
+            offered = tools.DECLARATIONS if round_ < LLM_MAX_TOOL_ROUNDS else []
+            text, turn, prompt_tokens, output_tokens = await self.tool_backend(
+                system_instruction, messages, offered
+            )
+            if turn is None:
+                metrics.histogram("llm.tool_rounds").observe(round_)
+                yield text, prompt_tokens, output_tokens
+                return
+
+            if prompt_tokens is not None:
+                metrics.histogram("llm.prompt_tokens").observe(prompt_tokens)
+            messages.append(turn)
+            for call in turn["tool_calls"]:
+                metrics.counter(f"llm.tool_calls.{call['name']}").inc()
+                messages.append({"role": "tool", "name": call["name"], "result": await tools.run(call["name"])})
+
+    async def stream(self, user_id: int, system_instruction: str, chat_history: list,
+                     timeout: float = LLM_TIMEOUT_SECONDS, tools=None, stamp=()):
+        """
+        Yields answer text as the backend produces it, or the cached answer
+        in one piece. With `tools` (an object with DECLARATIONS and an async
+        run(name)) the answer goes through the tool loop instead; `stamp`
+        must then change whenever the data behind the tools does. Failures
+        surface as HTTPException: 503/429 on admission, 504 past the
+        deadline, 502 for upstream errors. Closing the generator closes the
+        upstream call.
+        """
+        key = response_key(user_id, system_instruction, chat_history, stamp)
+        cached = _responses.get(key)
+        if cached is not None:
+            metrics.counter("llm.cache.hits").inc()
+            yield cached
+            return
+        metrics.counter("llm.cache.misses").inc()
+
+        self._acquire(user_id)
+        started = time.perf_counter()
+        # timeout_at scopes each await in this task rather than spawning one
+        # (as wait_for does), so cancellation reaches the upstream read
+        # directly and the backend stream can still be closed afterwards.
+        deadline = asyncio.get_running_loop().time() + timeout
+        if tools is None:
+            upstream = self.backend(system_instruction, chat_history)
+        else:
+            upstream = self._tool_loop(system_instruction, chat_history, tools)
+        first = True
+        answer = []
+        outcome = self.breaker.abandoned
+        try:
+            while True:
+                try:
+                    async with asyncio.timeout_at(deadline):
+                        text, prompt_tokens, output_tokens = await anext(upstream)
+                except StopAsyncIteration:
+                    break
+                if first:
+                    metrics.histogram("llm.ttft_ms").observe((time.perf_counter() - started) * 1000)
+                    first = False
+                if prompt_tokens is not None:
+                    metrics.histogram("llm.prompt_tokens").observe(prompt_tokens)
+                if output_tokens is not None:
+                    metrics.histogram("llm.output_tokens").observe(output_tokens)
+                if text:
+                    answer.append(text)
+                    yield text
+            outcome = self.breaker.succeeded
+            # Only whole answers: an abandoned or failed one never gets here.
+            _responses.set(key, "".join(answer))
+            metrics.histogram("llm.latency_ms").observe((time.perf_counter() - started) * 1000)
+        except asyncio.TimeoutError:
+            outcome = self.breaker.failed
+            metrics.counter("llm.timeouts").inc()
+            raise HTTPException(status_code=504, detail=TIMEOUT_DETAIL)
+        except Exception as e:
+            outcome = self.breaker.failed
+            metrics.counter("llm.errors").inc()
+            print(f"LLM Error: {e!r}")
+            raise HTTPException(status_code=502, detail=ERROR_DETAIL)
+        finally:
+            outcome()
+            self._release(user_id)
+            await upstream.aclose()
+
+    async def complete(self, user_id: int, system_instruction: str, chat_history: list,
+                       timeout: float = LLM_TIMEOUT_SECONDS, tools=None, stamp=()) -> str:
+        return "".join([
+            text async for text in self.stream(user_id, system_instruction, chat_history, timeout, tools, stamp)
+        ])
+
+
+gateway = LLMGateway(
+    BACKENDS[LLM_BACKEND],
+    TOOL_BACKENDS[LLM_BACKEND],
+    LLM_MAX_IN_FLIGHT,
+    LLM_MAX_IN_FLIGHT_PER_USER,
+    CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN_SECONDS),
+)
@@ -1,5 +1,23 @@
 import datetime
-from models import UserProfile, DailyWorkout, User
+import os
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import joinedload
+
+import versions
+from cache import TTLCache
+from db import db_session
+from models import UserProfile, DailyWorkout, TrainingPlan, User
+
+# Targets only depend on a handful of profile fields and the workout's shape,
+# so repeated plan views, PDF exports and chat turns reuse earlier results.
+# Entries are keyed on those inputs, so a stale one can never be served; the
+# TTL just bounds how long an unused calculator lingers.
+NUTRITION_CACHE_SIZE = int(os.getenv("NUTRITION_CACHE_SIZE", "4096"))
+NUTRITION_CACHE_TTL = float(os.getenv("NUTRITION_CACHE_TTL", "86400"))
+
+_calculators = TTLCache(maxsize=max(1, NUTRITION_CACHE_SIZE // 8), ttl=NUTRITION_CACHE_TTL)
+_daily_needs = TTLCache(maxsize=NUTRITION_CACHE_SIZE, ttl=NUTRITION_CACHE_TTL)
 
 class NutritionCalculator:
     """
@@ -19,7 +37,8 @@ class NutritionCalculator:
         
         self.bmr = (10 * self.profile.bodyweight) + (6.25 * self.profile.height) - (5 * self.age) + 5
 
-    def _calculate_age(self, birthdate):
+    @staticmethod
+    def _calculate_age(birthdate):
         today = datetime.date.today()
         return today.year - birthdate.year - ((today.month, today.day) < (birthdate.month, birthdate.day))
 
@@ -166,4 +185,144 @@ class NutritionCalculator:
             "advice": "Recovery Window: High Glycemic Carbs + Protein (2:1 Ratio)."
         })
 
-        return schedule
\ No newline at end of file
+        return schedule
+
+
+def _profile_key(user_profile: UserProfile, user: User) -> tuple:
+    # Age is part of the key so birthdays roll the cached BMR over.
+    return (
+        user.id,
+        user_profile.bodyweight,
+        user_profile.height,
+        user_profile.goal,
+        user.birthdate,
+        NutritionCalculator._calculate_age(user.birthdate),
+    )
+
+
+def _workout_key(workout: DailyWorkout) -> tuple:
+    return (
+        workout.id,
+        workout.date,
+        workout.workout_type,
+        workout.title,
+        workout.estimated_duration_min,
+        workout.is_rest_day,
+        workout.time_of_day,
+    )
+
+
+def get_calculator(user_profile: UserProfile, user: User) -> NutritionCalculator:
+    key = _profile_key(user_profile, user)
+    calc = _calculators.get(key)
+    if calc is None:
+        calc = NutritionCalculator(user_profile=user_profile, user=user)
+        _calculators.set(key, calc)
+    return calc
+
+
+def daily_needs(user_profile: UserProfile, user: User, workout: DailyWorkout) -> dict:
+    """
+    Memoized NutritionCalculator.calculate_daily_needs. The returned dict is
+    shared between callers and must not be mutated.
+    """
+    profile_key = _profile_key(user_profile, user)
+    key = (profile_key, _workout_key(workout))
+    needs = _daily_needs.get(key)
+    if needs is None:
+        needs = get_calculator(user_profile, user).calculate_daily_needs(workout)
+        _daily_needs.set(key, needs)
+    return needs
+
+
+def invalidate_user(user_id: int):
+    """Drops every cached calculator and target set for a user whose profile changed."""
+    _calculators.discard_where(lambda key, _: key[0] == user_id)
+    _daily_needs.discard_where(lambda key, _: key[0][0] == user_id)
+
+
+# Profile fields the targets depend on; changing any of them schedules a recompute.
+TARGET_INPUTS = ("bodyweight", "height", "goal")
+
+
+def stored_columns(needs: dict) -> dict:
+    """DailyWorkout column values persisting a calculate_daily_needs result."""
+    targets = needs["targets"]
+    return {
+        "intensity_label": needs["day_context"]["type"],
+        "target_calories": targets["calories"],
+        "target_protein": targets["protein"],
+        "target_carbs": targets["carbs"],
+        "target_fats": targets["fats"],
+        "target_hydration_liters": targets["hydration_liters"],
+        "nutrition_timing": needs["timing"],
+    }
+
+
+def store_targets(calc: NutritionCalculator, workout: DailyWorkout):
+    """Fills the stored target columns on a workout before it is inserted."""
+    for key, value in stored_columns(calc.calculate_daily_needs(workout)).items():
+        setattr(workout, key, value)
+
+
+def stored_needs(workout: DailyWorkout) -> dict | None:
+    if workout.target_calories is None:
+        return None
+    return {
+        "day_context": {
+            "date": workout.date,
+            "type": workout.intensity_label,
+            "duration": workout.estimated_duration_min,
+        },
+        "targets": {
+            "calories": workout.target_calories,
+            "protein": workout.target_protein,
+            "carbs": workout.target_carbs,
+            "fats": workout.target_fats,
+            "hydration_liters": workout.target_hydration_liters,
+        },
+        "timing": workout.nutrition_timing,
+    }
+
+
+def needs_for(user_profile: UserProfile, user: User, workout: DailyWorkout) -> dict:
+    """Stored targets, or the memoized calculation for rows from before they were stored."""
+    return stored_needs(workout) or daily_needs(user_profile, user, workout)
+
+
+async def recompute_targets(user_id: int):
+    """
+    Background task run after a profile change: rewrites the stored targets
+    of the user's current and upcoming plans. Past plans keep the targets
+    they were followed with.
+    """
+    try:
+        async with db_session() as db:
+            user = await db.scalar(
+                select(User).options(joinedload(User.profile)).where(User.id == user_id)
+            )
+            if not user or not user.profile:
+                return
+
+            workouts = (await db.scalars(
+                select(DailyWorkout)
+                .join(TrainingPlan)
+                .where(
+                    TrainingPlan.user_id == user_id,
+                    TrainingPlan.end_date >= datetime.date.today(),
+                )
+            )).all()
+            if not workouts:
+                return
+
+            calc = NutritionCalculator(user_profile=user.profile, user=user)
+            rows = [
+                {"id": workout.id, **stored_columns(calc.calculate_daily_needs(workout))}
+                for workout in workouts
+            ]
+            await db.execute(update(DailyWorkout), rows)
+            # Chat context and answers are keyed on this; see chat_context.
+            await versions.bump(db, user_id, versions.PLANS)
+            await db.commit()
+    except Exception as e:
+        print(f"Nutrition target recompute failed for user {user_id}: {e}")
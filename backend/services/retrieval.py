@@ -0,0 +1,216 @@
+"""
+Per-user retrieval over training history, so chat can answer questions
+about trends ("has my long run improved since March?") with a handful of
+relevant facts instead of the whole log.
+
+Each past workout, sleep log and nutrition log becomes one line of text,
+embedded locally as a hashed bag of words, word bigrams and character
+trigrams (signed feature hashing into RETRIEVAL_DIM floats, L2-normalized),
+so similarity is a single matrix-vector product in NumPy. No embedding
+service is involved. NumPy is imported on first use rather than with the
+app, so workers that never see a chat don't pay for it at boot.
+
+Indexes are built from the database on a user's first question and kept
+per process (RETRIEVAL_INDEX_USERS, RETRIEVAL_INDEX_TTL); log writes update
+the loaded index row in place instead of rebuilding it.
+"""
+import datetime
+import os
+import re
+import zlib
+
+from sqlalchemy import select
+from sqlalchemy.orm import load_only
+
+import metrics
+from cache import TTLCache
+from models import DailyNutritionLog, DailySleepLog, DailyWorkout, TrainingPlan
+
+RETRIEVAL_DIM = int(os.getenv("RETRIEVAL_DIM", "256"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.15"))
+RETRIEVAL_HISTORY_DAYS = int(os.getenv("RETRIEVAL_HISTORY_DAYS", "365"))
+
+_indexes = TTLCache(
+    maxsize=int(os.getenv("RETRIEVAL_INDEX_USERS", "128")),
+    ttl=float(os.getenv("RETRIEVAL_INDEX_TTL", "600")),
+)
+
+STOPWORDS = frozenset(
+    "a an and are as at be did do does for from has have how i in is it me my "
+    "of on or since so than that the this to was what when with you your".split()
+)
+
+
+def _features(text: str) -> list:
+    words = [w for w in re.findall(r"[a-z0-9]+", text.lower()) if w not in STOPWORDS]
+    features = list(words)
+    features += [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f"#{word}#"
+        features += [padded[i:i + 3] for i in range(len(padded) - 2)]
+    return features
+
+
+def embed(text: str):
+    import numpy as np
+
+    vector = np.zeros(RETRIEVAL_DIM, dtype=np.float32)
+    features = _features(text)
+    if not features:
+        return vector
+    hashes = np.fromiter((zlib.crc32(f.encode()) for f in features), dtype=np.uint32, count=len(features))
+    # Low bits pick the bucket, the top bit the sign, so collisions cancel
+    # out on average instead of piling up.
+    signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+    np.add.at(vector, hashes % RETRIEVAL_DIM, signs)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _day(day: datetime.date) -> str:
+    # Month and weekday names so "in March" or "on Sundays" can match.
+    return f"{day} ({day:%A, %B %Y})"
+
+
+def workout_fact(workout):
+    if workout.is_rest_day and not workout.notes:
+        return None
+    text = f"{_day(workout.date)} workout: {workout.title}"
+    if workout.modality:
+        text += f", {workout.modality}"
+    text += f", planned {workout.estimated_duration_min} min"
+    if workout.completed:
+        minutes = (workout.actual_duration or 0) // 60
+        text += f", done in {minutes} min"
+        if workout.rpe is not None:
+            text += f" at RPE {workout.rpe}/10"
+    else:
+        text += ", not completed"
+    if workout.notes:
+        text += f". Notes: {workout.notes}"
+    return ("workout", workout.id), text
+
+
+def sleep_fact(log):
+    def fmt(val): return f"{val}h" if val is not None else "n/a"
+    text = (
+        f"{_day(log.date)} sleep: {log.total_hours}h total "
+        f"(REM {fmt(log.rem_hours)}, deep {fmt(log.deep_hours)}, core {fmt(log.core_hours)}, awake {fmt(log.awake_hours)})"
+    )
+    if log.notes:
+        text += f". Notes: {log.notes}"
+    return ("sleep", log.date), text
+
+
+def nutrition_fact(log):
+    text = (
+        f"{_day(log.date)} nutrition: {log.calories_consumed} kcal, protein {log.protein_consumed}g, "
+        f"carbs {log.carbs_consumed}g, fats {log.fats_consumed}g, water {log.water_liters}L"
+    )
+    return ("nutrition", log.date), text
+
+
+class UserIndex:
+    """Fact texts and their embeddings, one row per fact key; rows are
+    replaced in place when a log is edited."""
+
+    def __init__(self):
+        import numpy as np
+
+        self._rows = {}
+        self._texts = []
+        self._vectors = np.zeros((0, RETRIEVAL_DIM), dtype=np.float32)
+
+    def __len__(self):
+        return len(self._texts)
+
+    def upsert(self, key, text: str):
+        row = self._rows.get(key)
+        if row is None:
+            row = len(self._texts)
+            self._rows[key] = row
+            self._texts.append(text)
+            if row == len(self._vectors):
+                import numpy as np
+
+                # Grow geometrically so incremental adds stay amortized O(1).
+                grown = np.zeros((max(16, 2 * row), RETRIEVAL_DIM), dtype=np.float32)
+                grown[:row] = self._vectors
+                self._vectors = grown
+        else:
+            self._texts[row] = text
+        self._vectors[row] = embed(text)
+
+    def search(self, query: str, k: int, min_score: float) -> list:
+        import numpy as np
+
+        n = len(self._texts)
+        if not n or k <= 0:
+            return []
+        scores = self._vectors[:n] @ embed(query)
+        top = np.argpartition(-scores, min(k, n) - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self._texts[i] for i in top if scores[i] >= min_score]
+
+
+async def _build(db, user_id: int) -> UserIndex:
+    today = datetime.date.today()
+    since = today - datetime.timedelta(days=RETRIEVAL_HISTORY_DAYS)
+    index = UserIndex()
+
+    workouts = (await db.scalars(
+        select(DailyWorkout)
+        .join(TrainingPlan)
+        .options(load_only(
+            DailyWorkout.date, DailyWorkout.title, DailyWorkout.modality,
+            DailyWorkout.estimated_duration_min, DailyWorkout.is_rest_day, DailyWorkout.completed,
+            DailyWorkout.actual_duration, DailyWorkout.rpe, DailyWorkout.notes,
+        ))
+        .where(TrainingPlan.user_id == user_id, DailyWorkout.date.between(since, today))
+    )).all()
+    sleep_logs = (await db.scalars(
+        select(DailySleepLog).where(DailySleepLog.user_id == user_id, DailySleepLog.date >= since)
+    )).all()
+    nutrition_logs = (await db.scalars(
+        select(DailyNutritionLog).where(DailyNutritionLog.user_id == user_id, DailyNutritionLog.date >= since)
+    )).all()
+
+    facts = [workout_fact(w) for w in workouts]
+    facts += [sleep_fact(log) for log in sleep_logs]
+    facts += [nutrition_fact(log) for log in nutrition_logs]
+    for fact in facts:
+        if fact:
+            index.upsert(*fact)
+    metrics.histogram("retrieval.index_facts").observe(len(index))
+    return index
+
+
+async def relevant_facts(db, user_id: int, question: str, k: int = RETRIEVAL_TOP_K) -> list:
+    index = _indexes.get(user_id)
+    if index is None:
+        metrics.counter("retrieval.builds").inc()
+        index = await _build(db, user_id)
+        _indexes.set(user_id, index)
+    # Every fact starts with its ISO date, so sorting puts them in time order
+    # and the model can read a trend off them.
+    return sorted(index.search(question, k, RETRIEVAL_MIN_SCORE))
+
+
+def history_block(facts: list) -> str:
+    """Prompt section for retrieved facts; empty when nothing matched."""
+    if not facts:
+        return ""
+    lines = "\n".join(f"    - {fact}" for fact in facts)
+    return f"\n    [RELEVANT HISTORY]\n{lines}\n    "
+
+
+def record(user_id: int, fact):
+    """Apply a log write to the user's index, if this process has one loaded."""
+    index = _indexes.get(user_id)
+    if index is not None and fact:
+        index.upsert(*fact)
+
+
+def invalidate(user_id: int):
+    _indexes.pop(user_id)
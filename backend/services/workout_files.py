@@ -0,0 +1,232 @@
+"""
+Compiles endurance workouts into trainer files (Zwift .zwo, and .erg/.mrc for
+ERG-mode apps) on demand instead of storing XML per row. Steps come from the
+workout's own structure when it has one, otherwise from the session shapes in
+constants (INTERVAL_SETS / STEADY_EFFORTS) stretched to the planned duration.
+"""
+import hashlib
+import json
+import os
+from xml.sax.saxutils import escape
+
+from cache import TTLCache
+from constants import EASY_POWER, INTERVAL_SETS, STEADY_EFFORTS, describe_interval_set
+
+FORMATS = {
+    "zwo": "application/xml",
+    "erg": "text/plain",
+    "mrc": "text/plain",
+}
+
+# Compiled files keyed on (workout id, structure hash, format, FTP): any edit
+# to the workout or the athlete's FTP lands on a new key.
+_compiled = TTLCache(
+    maxsize=int(os.getenv("WORKOUT_FILE_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("WORKOUT_FILE_CACHE_TTL", "86400")),
+)
+
+RAMP_SECONDS = 5 * 60
+
+
+def supports(workout) -> bool:
+    return workout.workout_type == "Endurance" and not workout.is_rest_day
+
+
+def profile_ftp(profile):
+    if profile and profile.endurance_metric_type == "FTP" and profile.endurance_metric_value:
+        return float(profile.endurance_metric_value)
+    return None
+
+
+def filename(workout, fmt: str) -> str:
+    return f"{workout.date}_{workout.title.replace(' ', '_')}.{fmt}"
+
+
+def structure_hash(workout) -> str:
+    payload = json.dumps(
+        [workout.title, workout.workout_type, workout.modality,
+         workout.estimated_duration_min, workout.structure_json],
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def _role(workout) -> str:
+    title = (workout.title or "").lower()
+    if "tempo" in title:
+        return "tempo"
+    if "interval" in title or "vo2" in title:
+        return "interval"
+    if "long" in title:
+        return "long"
+    if "recovery" in title:
+        return "recovery"
+    return "base"
+
+
+def _mid(power_range) -> float:
+    return round(sum(power_range) / 2, 2)
+
+
+def _interval_steps(role: str, total_s: int) -> list:
+    spec = INTERVAL_SETS[role]
+    warmup_s = spec["warmup_min"] * 60
+    cooldown_s = spec["cooldown_min"] * 60
+    on_s, off_s = spec["work_min"] * 60, spec["rest_min"] * 60
+    on_power = _mid(spec["work_power"])
+
+    # Drop reps until the set fits the planned duration; pad the rest at Zone 2.
+    reps = spec["reps"]
+    while reps > 1 and warmup_s + reps * (on_s + off_s) + cooldown_s > total_s:
+        reps -= 1
+    set_s = reps * (on_s + off_s)
+    if warmup_s + set_s + cooldown_s > total_s:
+        # Even one rep doesn't fit with the full warmup and cooldown: shorten
+        # both in proportion. A session shorter than one rep is just the rep.
+        ends_s = max(0, total_s - set_s)
+        warmup_s = ends_s * warmup_s // (warmup_s + cooldown_s)
+        cooldown_s = ends_s - warmup_s
+    filler_s = total_s - (warmup_s + set_s + cooldown_s)
+
+    steps = []
+    if warmup_s > 0:
+        steps.append(("ramp", warmup_s, EASY_POWER, _mid(STEADY_EFFORTS["base"]["power"])))
+    steps.append(("intervals", reps, on_s, on_power, off_s, EASY_POWER))
+    if filler_s > 0:
+        steps.append(("steady", filler_s, _mid(STEADY_EFFORTS["base"]["power"])))
+    if cooldown_s > 0:
+        steps.append(("ramp", cooldown_s, EASY_POWER, EASY_POWER - 0.1))
+    return steps
+
+
+def _steady_steps(role: str, total_s: int) -> list:
+    power = _mid(STEADY_EFFORTS[role]["power"])
+    ramp_s = min(RAMP_SECONDS, total_s // 4)
+    return [
+        ("ramp", ramp_s, EASY_POWER - 0.1, power),
+        ("steady", total_s - 2 * ramp_s, power),
+        ("ramp", ramp_s, power, EASY_POWER - 0.1),
+    ]
+
+
+def _structured_steps(workout, ftp) -> list:
+    """Explicit steps ({"duration": s, "power": watts}) when the workout has them."""
+    steps = []
+    for step in workout.structure_json or []:
+        duration = step.get("duration")
+        if not isinstance(duration, int) or duration <= 0:
+            continue
+        power = step.get("power")
+        steps.append(("steady", duration, round(power / ftp, 2) if power and ftp else EASY_POWER))
+    return steps
+
+
+def build_steps(workout, ftp=None) -> list:
+    steps = _structured_steps(workout, ftp)
+    if steps:
+        return steps
+
+    role = _role(workout)
+    total_s = max(0, workout.estimated_duration_min or 0) * 60
+    if role in INTERVAL_SETS:
+        return _interval_steps(role, total_s)
+    return _steady_steps(role, total_s)
+
+
+def _description(workout, steps) -> str:
+    role = _role(workout)
+    if role in INTERVAL_SETS:
+        reps = next((step[1] for step in steps if step[0] == "intervals"), None)
+        return describe_interval_set(role, reps)["main_set"]
+    return STEADY_EFFORTS[role]["effort"]
+
+
+def _to_zwo(workout, steps) -> str:
+    sport = "run" if "run" in (workout.modality or "").lower() else "bike"
+    lines = [
+        "<workout_file>",
+        "    <author>Ironclad</author>",
+        f"    <name>{escape(workout.title)}</name>",
+        f"    <description>{escape(_description(workout, steps))}</description>",
+        f"    <sportType>{sport}</sportType>",
+        "    <workout>",
+    ]
+    last = len(steps) - 1
+    for i, step in enumerate(steps):
+        kind = step[0]
+        if kind == "ramp":
+            _, duration, start, end = step
+            tag = "Warmup" if i == 0 else "Cooldown" if i == last else "Ramp"
+            lines.append(f'        <{tag} Duration="{duration}" PowerLow="{start:.2f}" PowerHigh="{end:.2f}"/>')
+        elif kind == "steady":
+            _, duration, power = step
+            lines.append(f'        <SteadyState Duration="{duration}" Power="{power:.2f}"/>')
+        else:
+            _, reps, on_s, on_power, off_s, off_power = step
+            lines.append(
+                f'        <IntervalsT Repeat="{reps}" OnDuration="{on_s}" OffDuration="{off_s}" '
+                f'OnPower="{on_power:.2f}" OffPower="{off_power:.2f}"/>'
+            )
+    lines += ["    </workout>", "</workout_file>", ""]
+    return "\n".join(lines)
+
+
+def _points(steps) -> list:
+    """(seconds, fraction of FTP) breakpoints; each segment has a start and end point."""
+    points, t = [], 0
+
+    def segment(duration, start, end):
+        nonlocal t
+        points.append((t, start))
+        t += duration
+        points.append((t, end))
+
+    for step in steps:
+        if step[0] == "ramp":
+            segment(step[1], step[2], step[3])
+        elif step[0] == "steady":
+            segment(step[1], step[2], step[2])
+        else:
+            _, reps, on_s, on_power, off_s, off_power = step
+            for _ in range(reps):
+                segment(on_s, on_power, on_power)
+                segment(off_s, off_power, off_power)
+    return points
+
+
+def _to_course(workout, steps, fmt: str, ftp) -> str:
+    header = [
+        "[COURSE HEADER]",
+        "VERSION = 2",
+        "UNITS = ENGLISH",
+        f"DESCRIPTION = {_description(workout, steps)}",
+        f"FILE NAME = {filename(workout, fmt)}",
+    ]
+    if fmt == "erg":
+        header += [f"FTP = {round(ftp)}", "MINUTES WATTS"]
+        scale = lambda p: round(p * ftp)
+    else:
+        header.append("MINUTES PERCENT")
+        scale = lambda p: round(p * 100)
+
+    data = [f"{seconds / 60:.2f}\t{scale(power)}" for seconds, power in _points(steps)]
+    return "\n".join(header + ["[END COURSE HEADER]", "[COURSE DATA]"] + data + ["[END COURSE DATA]", ""])
+
+
+def compile_workout(workout, fmt: str, ftp=None) -> str:
+    """
+    File contents for a supported workout. ERG needs an FTP (absolute watts);
+    ZWO and MRC are relative to FTP and only use it for explicit watt steps.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown workout file format {fmt!r}")
+    if fmt == "erg" and not ftp:
+        raise ValueError("ERG files need an FTP")
+
+    key = (workout.id, structure_hash(workout), fmt, ftp)
+    content = _compiled.get(key)
+    if content is None:
+        steps = build_steps(workout, ftp)
+        content = _to_zwo(workout, steps) if fmt == "zwo" else _to_course(workout, steps, fmt, ftp)
+        _compiled.set(key, content)
+    return content
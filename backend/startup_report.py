@@ -0,0 +1,62 @@
+"""
+Cold-start report for the API process.
+
+    python startup_report.py                 top 25 imports by cumulative time
+    python startup_report.py --top 50 --budget-ms 800
+
+Runs `python -X importtime -c "import main"` in a fresh interpreter, so the
+numbers match what a new uvicorn worker pays, and exits non-zero when the
+total exceeds --budget-ms (handy as a CI gate when tuning autoscaling).
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+def measure(module: str = "main"):
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise SystemExit(f"Importing {module} failed:\n{proc.stderr[-2000:]}")
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.rstrip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def report(rows, top: int):
+    # Top-level entries (no indentation) add up to the whole import.
+    total_us = sum(cum for name, _, cum in rows if not name.startswith("  "))
+
+    print(f"Total import time: {total_us / 1000:.1f} ms ({len(rows)} modules)\n")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for name, self_us, cumulative_us in sorted(rows, key=lambda r: r[2], reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {name}")
+    return total_us / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ironclad startup-time report")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    total_ms = report(measure(args.module), args.top)
+
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        print(f"\nOver budget: {total_ms:.1f} ms > {args.budget_ms:.1f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+Tests run against a throwaway SQLite database and fake_llm.py instead of
+Gemini. The app reads its configuration at import time, so the environment
+is set here, before any test module imports main.
+
+    cd backend && python -m pytest tests
+"""
+import os
+import socket
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+FAKE_LLM_PORT = free_port()
+
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/ironclad-test.db"
+os.environ["DB_MODE"] = "async"
+os.environ["GOOGLE_API_KEY"] = "fake"
+os.environ["GEMINI_BASE_URL"] = f"http://127.0.0.1:{FAKE_LLM_PORT}"
+os.environ["LLM_BACKEND"] = "gemini"
+os.environ["CHAT_MODE"] = "context"
+os.environ["LLM_TIMEOUT_SECONDS"] = "2"
+os.environ["FAKE_LLM_TTFT_MS"] = "200"
+os.environ["FAKE_LLM_TOKEN_MS"] = "20"
+os.environ["FAKE_LLM_TOKENS"] = "40"
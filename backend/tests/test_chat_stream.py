@@ -0,0 +1,151 @@
+"""
+/chat/stream end to end: the app and fake_llm.py both run under uvicorn on
+real sockets (an in-process ASGI transport buffers the whole body, which
+would hide whether chunks arrive incrementally), with the google-genai
+client talking to the fake over HTTP.
+"""
+import datetime
+import json
+import threading
+import time
+
+import httpx
+import pytest
+import uvicorn
+
+from conftest import FAKE_LLM_PORT, free_port
+
+import fake_llm
+import main
+import metrics
+from auth import create_token
+from db import Base, SessionLocal, engine
+from models import ChatConversation, User
+
+
+class ThreadedServer:
+    def __init__(self, app, port: int):
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.monotonic() + 10
+        while not self.server.started:
+            assert time.monotonic() < deadline, "server did not start"
+            time.sleep(0.02)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+@pytest.fixture(scope="module")
+def client():
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as session:
+        session.add(User(
+            email="stream@example.com", first_name="Stream", last_name="Test",
+            birthdate=datetime.date(1990, 1, 1), is_verified=True,
+        ))
+        session.commit()
+
+    port = free_port()
+    headers = {"Authorization": f"Bearer {create_token('stream@example.com')}"}
+    with ThreadedServer(fake_llm.app, FAKE_LLM_PORT), ThreadedServer(main.app, port):
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", headers=headers, timeout=10) as http:
+            yield http
+
+
+def read_events(response, stop_after_deltas=None):
+    """(event, data, seconds since the request) per SSE event."""
+    started = time.perf_counter()
+    events = []
+    event = "message"
+    for line in response.iter_lines():
+        if line.startswith("event:"):
+            event = line.split(":", 1)[1].strip()
+        elif line.startswith("data:"):
+            events.append((event, json.loads(line.split(":", 1)[1]), time.perf_counter() - started))
+            event = "message"
+            deltas = sum(1 for e in events if e[0] == "message")
+            if stop_after_deltas and deltas >= stop_after_deltas:
+                break
+    return events
+
+
+def counter(name: str) -> int:
+    return metrics.snapshot().get(name, 0)
+
+
+def histogram_count(name: str) -> int:
+    return metrics.snapshot().get(name, {}).get("count", 0)
+
+
+def test_chunks_arrive_as_they_are_generated(client):
+    with client.stream("POST", "/chat/stream", json={"message": "how was my long run?"}) as response:
+        assert response.status_code == 200
+        events = read_events(response)
+
+    deltas = [(data["delta"], at) for event, data, at in events if event == "message"]
+    assert len(deltas) > 10
+    assert "how was my long run?" in "".join(text for text, _ in deltas)
+    # The fake emits a word every FAKE_LLM_TOKEN_MS; a buffered response
+    # would deliver them all at once.
+    token_seconds = fake_llm.FAKE_LLM_TOKEN_MS / 1000
+    assert deltas[-1][1] - deltas[0][1] > (fake_llm.FAKE_LLM_TOKENS - 1) * token_seconds / 2
+
+    event, data, _ = events[-1]
+    assert event == "done"
+    assert data["conversation_id"]
+
+
+def test_time_to_first_token_is_recorded(client):
+    before_chat = histogram_count("chat.stream.ttft_ms")
+    before_llm = histogram_count("llm.ttft_ms")
+
+    with client.stream("POST", "/chat/stream", json={"message": "what should I eat today?"}) as response:
+        read_events(response)
+
+    assert histogram_count("chat.stream.ttft_ms") == before_chat + 1
+    assert histogram_count("llm.ttft_ms") == before_llm + 1
+    assert metrics.snapshot()["llm.ttft_ms"]["max"] >= fake_llm.FAKE_LLM_TTFT_MS * 0.9
+
+
+def test_deadline_ends_the_stream_with_an_error_event(client, monkeypatch):
+    monkeypatch.setattr(fake_llm, "FAKE_LLM_TTFT_MS", 10_000)
+    timeouts = counter("llm.timeouts")
+
+    started = time.perf_counter()
+    with client.stream("POST", "/chat/stream", json={"message": "is anyone there?"}) as response:
+        assert response.status_code == 200
+        events = read_events(response)
+
+    assert time.perf_counter() - started < 10
+    assert [event for event, _, _ in events] == ["error"]
+    assert events[0][1]["status"] == 504
+    assert counter("llm.timeouts") == timeouts + 1
+
+
+def test_client_disconnect_stops_the_upstream_stream(client, monkeypatch):
+    # Long enough that the fake would still be generating well after the
+    # client has gone, but inside LLM_TIMEOUT_SECONDS.
+    monkeypatch.setattr(fake_llm, "FAKE_LLM_TOKEN_MS", 40)
+    abandoned = counter("fake_llm.abandoned_streams")
+    disconnects = counter("chat.stream.disconnects")
+    with SessionLocal() as session:
+        conversations = session.query(ChatConversation).count()
+
+    with client.stream("POST", "/chat/stream", json={"message": "tell me about recovery"}) as response:
+        events = read_events(response, stop_after_deltas=2)
+    assert len(events) == 2
+
+    deadline = time.monotonic() + 1
+    while counter("fake_llm.abandoned_streams") == abandoned and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert counter("fake_llm.abandoned_streams") == abandoned + 1
+    assert counter("chat.stream.disconnects") == disconnects + 1
+    # An abandoned answer isn't saved as a conversation.
+    with SessionLocal() as session:
+        assert session.query(ChatConversation).count() == conversations
@@ -0,0 +1,79 @@
+"""
+Per-user, per-resource version counters backing ETags on the polling GETs.
+
+Write endpoints bump the counters in the same transaction as their change;
+reads fetch one integer by primary key and answer If-None-Match with 304
+before loading or serializing anything. Counters live in the database so
+every worker agrees on them, which also makes them the cross-worker key for
+the per-process chat caches (see `stamp`).
+"""
+from fastapi import Response
+from sqlalchemy import select
+
+from db import UPSERT_INSERTS
+from models import ResourceVersion
+
+PROFILE = "profile"
+PLANS = "plans"
+NUTRITION = "nutrition"
+SLEEP = "sleep"
+
+
+async def bump(db, user_id: int, *resources: str):
+    dialect = db.get_bind().dialect.name
+    stmt = UPSERT_INSERTS[dialect](ResourceVersion).values(
+        [{"user_id": user_id, "resource": resource, "version": 1} for resource in resources]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "resource"],
+        set_={"version": ResourceVersion.version + 1},
+    )
+    await db.execute(stmt)
+
+
+async def current(db, user_id: int, resource: str) -> int:
+    version = await db.scalar(
+        select(ResourceVersion.version).where(
+            ResourceVersion.user_id == user_id,
+            ResourceVersion.resource == resource,
+        )
+    )
+    return version or 0
+
+
+async def stamp(db, user_id: int, *resources: str) -> tuple:
+    """Current versions of several resources in one query, in argument order."""
+    rows = await db.execute(
+        select(ResourceVersion.resource, ResourceVersion.version).where(
+            ResourceVersion.user_id == user_id,
+            ResourceVersion.resource.in_(resources),
+        )
+    )
+    found = dict(rows.all())
+    return tuple(found.get(resource, 0) for resource in resources)
+
+
+def etag(user_id: int, resource: str, version: int, *extra) -> str:
+    parts = [resource, str(user_id), str(version), *map(str, extra)]
+    return '"' + "-".join(parts) + '"'
+
+
+def matches(if_none_match: str | None, tag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (c.strip().removeprefix("W/") for c in if_none_match.split(","))
+    return tag in candidates
+
+
+CACHE_HEADERS = {"Cache-Control": "private, no-cache"}
+
+
+def not_modified(tag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": tag, **CACHE_HEADERS})
+
+
+def tag_response(response: Response, tag: str):
+    response.headers["ETag"] = tag
+    response.headers.update(CACHE_HEADERS)
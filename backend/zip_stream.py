@@ -0,0 +1,132 @@
+"""
+ZIP archives streamed member by member. zipfile writes data descriptors when
+its target can't seek, so each member's bytes can be handed to the client as
+soon as it is written; the archive is never held in memory as a whole.
+
+Once bytes have gone out the status line can't change, so a member that
+fails after that is left out and listed in a final ERRORS.txt instead; the
+central directory is still written and the archive stays readable. Failures
+before the first member is written propagate, so callers that await the
+first chunk (see `started`) can still answer with a real error status.
+"""
+import asyncio
+import zipfile
+from collections import deque
+from datetime import datetime
+from typing import Awaitable, Callable, NamedTuple
+
+
+class Member(NamedTuple):
+    name: str
+    produce: Callable[[], Awaitable[bytes]]
+    compress: bool = True
+
+
+async def ready(data: bytes) -> bytes:
+    """Member.produce for content that is already in hand."""
+    return data
+
+
+class _Sink:
+    """Write-only, non-seekable file object zipfile writes into; drained after each member."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def seekable(self):
+        return False
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+ERRORS_NAME = "ERRORS.txt"
+
+
+async def stream_zip(members: list, window: int = 4):
+    """
+    Async iterator of archive bytes. Up to `window` members are produced
+    concurrently ahead of the one being written; they are still written in
+    order, so memory stays bounded by the window rather than the archive.
+    """
+    sink = _Sink()
+    archive = zipfile.ZipFile(sink, mode="w")
+    pending = deque()
+    upcoming = iter(members)
+    timestamp = datetime.now().timetuple()[:6]
+    failed = []
+    written = 0
+
+    def fill():
+        while len(pending) < window:
+            member = next(upcoming, None)
+            if member is None:
+                return
+            pending.append((member, asyncio.ensure_future(member.produce())))
+
+    def write(name, data, compress=True):
+        info = zipfile.ZipInfo(name, date_time=timestamp)
+        info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        archive.writestr(info, data)
+
+    try:
+        fill()
+        while pending:
+            member, task = pending.popleft()
+            try:
+                data = await task
+            except Exception as e:
+                if not written:
+                    raise
+                print(f"Archive member {member.name} failed: {e!r}")
+                reason = getattr(e, "detail", None) or repr(e)
+                failed.append(f"{member.name}: {reason}")
+                fill()
+                continue
+            fill()
+
+            write(member.name, data, member.compress)
+            written += 1
+            yield sink.drain()
+
+        if failed:
+            write(ERRORS_NAME, ("These files could not be generated:\n" + "\n".join(failed) + "\n").encode())
+        archive.close()
+        yield sink.drain()
+    finally:
+        # Client went away or a member failed: don't leave renders running.
+        for _, task in pending:
+            task.cancel()
+
+
+async def started(chunks):
+    """
+    Awaits the first chunk of `chunks` before returning an iterator over
+    all of them, so errors up to that point are raised here, before a
+    response has begun.
+    """
+    first = await anext(chunks)
+
+    async def resume():
+        try:
+            yield first
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    return resume()
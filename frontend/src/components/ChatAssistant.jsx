@@ -15,6 +15,7 @@ export default function ChatAssistant() {
   ]);
 
   const [isTyping, setIsTyping] = useState(false);
+  const conversationId = useRef(null);
 
   const scrollRef = useRef(null);
   const location = useLocation();
@@ -43,6 +44,7 @@ export default function ChatAssistant() {
       const token = localStorage.getItem("token");
 
       const res = await fetch("http://localhost:8000/chat", {
+        credentials: "include",
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -50,11 +52,16 @@ export default function ChatAssistant() {
         },
         body: JSON.stringify({
           message: userMsg.content,
-          history: [...messages, userMsg],
+          conversation_id: conversationId.current,
         }),
       });
 
+      // The conversation expired or was never saved; the next message starts a new one.
+      if (res.status === 404) conversationId.current = null;
+      if (!res.ok) throw new Error(`Chat failed: ${res.status}`);
+
       const data = await res.json();
+      if (data.conversation_id) conversationId.current = data.conversation_id;
 
       setMessages(prev => [
         ...prev,
@@ -41,6 +41,7 @@ export default function SessionExecute({ workout, onClose, onComplete }) {
       const res = await fetch(
         `http://localhost:8000/workouts/${workout.id}/complete`,
         {
+          credentials: "include",
           method: "PUT",
           headers: {
             "Content-Type": "application/json",
@@ -21,6 +21,7 @@ export default function DailyPlan() {
   const handleDownloadZwo = async () => {
     try {
       const response = await fetch(`http://localhost:8000/workouts/${workout.id}/zwo`, {
+        credentials: "include",
         headers: { Authorization: `Bearer ${token}` }
       });
       if (!response.ok) throw new Error("Download failed");
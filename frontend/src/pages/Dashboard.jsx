@@ -49,6 +49,7 @@ export default function DashboardRevamp() {
 
     try {
       const planRes = await fetch("http://localhost:8000/plans/latest", {
+        credentials: "include",
         headers: { Authorization: `Bearer ${token}` },
       });
 
@@ -70,6 +71,7 @@ export default function DashboardRevamp() {
     setLoading(true);
     try {
       const res = await fetch("http://localhost:8000/plans/generate", {
+        credentials: "include",
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -102,6 +104,7 @@ export default function DashboardRevamp() {
 
       try {
         const userRes = await fetch("http://localhost:8000/me", {
+          credentials: "include",
           headers: { Authorization: `Bearer ${token}` },
         });
         if (!userRes.ok) throw new Error();
@@ -114,6 +117,7 @@ export default function DashboardRevamp() {
         setUser(userData);
 
         const planRes = await fetch("http://localhost:8000/plans/latest", {
+          credentials: "include",
           headers: { Authorization: `Bearer ${token}` },
         });
 
@@ -135,7 +139,7 @@ export default function DashboardRevamp() {
 
              const nutRes = await fetch(
                 `http://localhost:8000/plans/${plan.id}/nutrition-plan`,
-                { headers: { Authorization: `Bearer ${token}` } }
+                { credentials: "include", headers: { Authorization: `Bearer ${token}` } }
              );
              if (nutRes.ok) {
                 const week = await nutRes.json();
@@ -149,7 +153,7 @@ export default function DashboardRevamp() {
 
         const logsRes = await fetch(
           "http://localhost:8000/nutrition/logs/week",
-          { headers: { Authorization: `Bearer ${token}` } }
+          { credentials: "include", headers: { Authorization: `Bearer ${token}` } }
         );
         if (logsRes.ok) {
           const logs = await logsRes.json();
@@ -164,6 +168,7 @@ export default function DashboardRevamp() {
         }
 
         const sleepRes = await fetch("http://localhost:8000/sleep/today", {
+          credentials: "include",
           headers: { Authorization: `Bearer ${token}` },
         });
         if (sleepRes.ok) {
@@ -99,6 +99,7 @@ export default function EditProfile() {
 
       try {
         const res = await fetch("http://localhost:8000/profile", {
+          credentials: "include",
           headers: { Authorization: `Bearer ${token}` },
         });
         if (res.ok) {
@@ -122,6 +123,7 @@ export default function EditProfile() {
 
     try {
       const res = await fetch("http://localhost:8000/profile", {
+        credentials: "include",
         method: "PUT",
         headers: {
           "Content-Type": "application/json",
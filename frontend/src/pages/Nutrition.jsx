@@ -84,6 +84,7 @@ export default function Nutrition() {
     try {
      
       const planRes = await fetch("http://localhost:8000/plans/latest", {
+        credentials: "include",
         headers: { Authorization: `Bearer ${token}` },
       });
       if (!planRes.ok) throw new Error();
@@ -94,14 +95,14 @@ export default function Nutrition() {
       
       const nutRes = await fetch(
         `http://localhost:8000/plans/${planData.id}/nutrition-plan`,
-        { headers: { Authorization: `Bearer ${token}` } }
+        { credentials: "include", headers: { Authorization: `Bearer ${token}` } }
       );
       if (nutRes.ok) setWeeklyNutrition(await nutRes.json());
 
 
       const logsRes = await fetch(
         "http://localhost:8000/nutrition/logs/week",
-        { headers: { Authorization: `Bearer ${token}` } }
+        { credentials: "include", headers: { Authorization: `Bearer ${token}` } }
       );
       if (logsRes.ok) {
         const logs = await logsRes.json();
@@ -128,6 +129,7 @@ export default function Nutrition() {
     
     try {
         const res = await fetch(`http://localhost:8000/plans/${planId}/export/nutrition-pdf`, {
+            credentials: "include",
             headers: { Authorization: `Bearer ${token}` }
         });
         
@@ -155,6 +157,7 @@ export default function Nutrition() {
     const date = selectedDay.day_context.date.substring(0, 10);
 
     await fetch("http://localhost:8000/nutrition/log", {
+      credentials: "include",
       method: "POST",
       headers: {
         "Content-Type": "application/json",
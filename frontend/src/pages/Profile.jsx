@@ -76,6 +76,7 @@ export default function ProfileSetup() {
 
     try {
       const res = await fetch("http://localhost:8000/profile", {
+        credentials: "include",
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -67,6 +67,7 @@ export default function SleepTracker() {
 
     try {
       const res = await fetch("http://localhost:8000/sleep/history", {
+        credentials: "include",
         headers: { Authorization: `Bearer ${token}` },
       });
       if (res.ok) setHistory(await res.json());
@@ -84,6 +85,7 @@ export default function SleepTracker() {
     const token = localStorage.getItem("token");
 
     await fetch("http://localhost:8000/sleep/log", {
+      credentials: "include",
       method: "POST",
       headers: {
         "Content-Type": "application/json",
@@ -16,6 +16,7 @@ export default function WeeklyPlan() {
 
       try {
         const res = await fetch("http://localhost:8000/plans/latest", {
+          credentials: "include",
           headers: { Authorization: `Bearer ${token}` },
         });
 
@@ -41,6 +42,7 @@ export default function WeeklyPlan() {
 
     try {
       const res = await fetch("http://localhost:8000/plans/generate", {
+        credentials: "include",
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -69,6 +71,7 @@ export default function WeeklyPlan() {
 
     try {
       const res = await fetch(`http://localhost:8000/plans/${plan.id}/export/pdf`, {
+        credentials: "include",
         headers: { Authorization: `Bearer ${token}` },
       });
 
@@ -17,6 +17,7 @@ export default function ProfileGuard({ children }) {
 
       try {
         const res = await fetch("http://localhost:8000/me", {
+          credentials: "include",
           headers: { Authorization: `Bearer ${token}` },
         });
 
@@ -2,6 +2,7 @@ export async function fetchMe() {
   const token = localStorage.getItem("token");
 
   const res = await fetch("http://localhost:8000/me", {
+    credentials: "include",
     headers: {
       Authorization: `Bearer ${token}`,
     },